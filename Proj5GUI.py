@@ -208,30 +208,12 @@ class Proj5GUI( QMainWindow ):
 
 
 	   
-	def newPoints(self):		
-		# TODO - ERROR CHECKING!!!!
-		seed = int(self.curSeed.text())
-		random.seed( seed )
-
-		ptlist = []
-		RANGE = self.data_range
-		xr = self.data_range['x']
-		yr = self.data_range['y']
-		npoints = int(self.size.text())
-		while len(ptlist) < npoints:
-			x = random.uniform(0.0,1.0)
-			y = random.uniform(0.0,1.0)
-			if True:
-				xval = xr[0] + (xr[1]-xr[0])*x
-				yval = yr[0] + (yr[1]-yr[0])*y
-				ptlist.append( QPointF(xval,yval) )
-		return ptlist
-
 	def generateNetwork(self):
-		points = self.newPoints() # uses current rand seed
-		diff = self.diffDropDown.currentText()
+		# TODO - ERROR CHECKING!!!!
 		rand_seed = int(self.curSeed.text())
-		self._scenario = Scenario( city_locations=points, difficulty=diff, rand_seed=rand_seed )
+		xs, ys = newPoints( int(self.size.text()), rand_seed, self.data_range ) # uses current rand seed
+		diff = self.diffDropDown.currentText()
+		self._scenario = Scenario.fromCoordinates( xs, ys, difficulty=diff.strip(), rand_seed=rand_seed )
 
 		self.genParams = {'size':self.size.text(),'seed':self.curSeed.text(),'diff':diff}
 		self.view.clearEdges()
@@ -302,8 +284,8 @@ class Proj5GUI( QMainWindow ):
 		self.statusBar.showMessage('Processing...')
 		#self.view.repaint()
 		#app.processEvents()
-		solve_func = 'self.solver.'+self.ALGORITHMS[self.algDropDown.currentIndex()][1]
-		results = eval(solve_func)(time_allowance=max_time )
+		algorithm = TSPSolver.ALGORITHMS[self.algDropDown.currentIndex()][1]
+		results = self.solver.solve( algorithm, time_allowance=max_time )
 		if results:
 			self.statusBar.showMessage('')
 			self.numSolutions.setText( '{}'.format(results['count']) )
@@ -366,13 +348,6 @@ class Proj5GUI( QMainWindow ):
 
 		return '' if retval==None else retval
 			
-	ALGORITHMS = [ \
-		('Default                            ','defaultRandomTour'), \
-		('Greedy','greedy'), \
-		('Branch and Bound','branchAndBound'), \
-		('Fancy','fancy') \
-	]															# whitespace hack to get longest to display correctly
-
 	def initUI( self ):
 		self.setWindowTitle('Traveling Salesperson Problem')
 		self.setWindowIcon( QIcon('icon312.png') )
@@ -386,9 +361,7 @@ class Proj5GUI( QMainWindow ):
 		self.setCentralWidget( boxwidget )
 
 
-		SCALE = 1.0
-		self.data_range		= { 'x':[-1.5*SCALE,1.5*SCALE], \
-								'y':[-SCALE,SCALE] }
+		self.data_range		= DATA_RANGE
 		self.view			= PointLineView( self.statusBar, \
 											 self.data_range )
 		self.randSeedButton = QPushButton('Randomize Seed')
@@ -497,11 +470,11 @@ class Proj5GUI( QMainWindow ):
 		self.diffDropDown.setCurrentIndex(3)
 		self.diffChanged(3) # to handle start state
 
-		for alg in self.ALGORITHMS:
-			self.algDropDown.addItem( alg[0] )
+		for i, (label, _) in enumerate(TSPSolver.ALGORITHMS):
+			self.algDropDown.addItem( label.ljust(35) if i == 0 else label )	# whitespace hack to get longest to display correctly
 		self.algDropDown.activated.connect(self.algChanged)
-		self.algDropDown.setCurrentIndex(2)
-		self.algChanged(2) # to handle start state
+		self.algDropDown.setCurrentIndex(6)
+		self.algChanged(6) # to handle start state
 
 		self.graphReady = False
 
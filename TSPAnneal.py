@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+
+import math
+import numpy as np
+import time
+
+from TSPCosts import withMissing
+
+
+
+
+''' <summary>
+	Simulated annealing over a tour stored as an array of city indices.
+
+	Moves are proposed a batch at a time: random 2-opt moves (a city and one of
+	its candidate neighbors as its new successor) and random Or-opt moves (a
+	segment of 1 to OR_OPT_LENGTH cities and a candidate neighbor of its last
+	city as the segment's new successor).  Or-opt keeps the segment's direction,
+	which matters more than 2-opt's reversals when costs are asymmetric.  Every
+	move in the batch is scored at once by fancy indexing into the cost matrix,
+	with the cost of the edges inside a reversed segment read from prefix sums of
+	the tour walked forwards and backwards.  The Metropolis rule is drawn for the
+	whole batch at once too.
+
+	Accepted moves are applied in batch order as long as each one's window of
+	tour positions does not overlap a window already changed, since a move only
+	touches positions inside its window and its score stays exact.  The tour is
+	then re-indexed once for the batch, so the interpreter does O(1) work per
+	proposed move and numpy does the rest.
+
+	The temperature falls from a starting value, where a typical uphill move is
+	accepted with probability START_ACCEPTANCE, to END_RATIO of it, either
+	exponentially or linearly in time.  The time allowance is split into one
+	cooling run plus one per reheat, and every reheat starts from the best tour
+	so far.
+
+	Costs are asymmetric and Hard mode removes edges; a missing edge is scored as
+	MISSING_EDGE, so no move that adds one is ever accepted.
+	</summary> '''
+class Annealer:
+
+	MISSING_EDGE = 2**40 # As in LocalSearch
+	OR_OPT_LENGTH = 20 # Longest segment an Or-opt move takes
+	TWO_OPT_SHARE = 0.3 # Share of proposed moves that are 2-opt, the rest being Or-opt
+	START_ACCEPTANCE = 0.05 # Chance a median uphill move from the starting tour is accepted at the start
+	END_RATIO = 1e-2 # Final temperature as a fraction of the starting one
+	SCHEDULES = ('exponential', 'linear')
+
+	def __init__( self, costs, tour, neighbors, rng=np.random ):
+		self._costs = withMissing( costs, self.MISSING_EDGE )
+		self._n = len(tour)
+		self._rng = rng
+		# Candidate neighbors padded into a table, with each city's count alongside
+		self._counts = np.array( [ len(nbrs) for nbrs in neighbors ], dtype=np.intp )
+		self._table = np.zeros( (self._n, max(self._counts.max(), 1)), dtype=np.intp )
+		for city, nbrs in enumerate(neighbors):
+			self._table[city, :len(nbrs)] = nbrs
+		self.proposed = 0
+		self.accepted = 0
+		self._setTour( np.array( tour, dtype=np.intp ) )
+
+	# Rebuilds the positions and prefix sums for a new tour array
+	# fwd[k] is the cost of walking tour[0] -> ... -> tour[k], bwd[k] of walking it backwards
+	# TIME: N
+	def _setTour( self, tour ):
+		self._tour = tour
+		self._pos = np.empty( self._n, dtype=np.intp )
+		self._pos[tour] = np.arange( self._n )
+		self._fwd = np.zeros( self._n, dtype=np.int64 )
+		self._bwd = np.zeros( self._n, dtype=np.int64 )
+		np.cumsum( self._costs[tour[:-1], tour[1:]], out=self._fwd[1:] )
+		np.cumsum( self._costs[tour[1:], tour[:-1]], out=self._bwd[1:] )
+		self.cost = int( self._fwd[-1] + self._costs[tour[-1], tour[0]] )
+
+
+
+	''' <summary>
+		Anneals until the deadline, with reheats extra cooling runs, each taking
+		an equal share of the time and starting again from the best tour found.
+		</summary>
+		<returns>a generator of (cost, tour) for each batch that ends with a new
+		best tour</returns> '''
+	def anneal( self, deadline, schedule='exponential', reheats=0, batch_size=1024 ):
+		if schedule not in self.SCHEDULES:
+			raise ValueError( 'unknown cooling schedule {!r}'.format(schedule) )
+		if self._n < 5:
+			return
+
+		start_time = time.time()
+		run_length = max( deadline - start_time, 0.0 ) / (reheats + 1)
+		hot = self._startTemperature( batch_size )
+		cold = hot * self.END_RATIO
+		best_cost, best_tour = self.cost, self._tour.copy()
+		run = 0
+
+		while True:
+			now = time.time()
+			if now >= deadline:
+				return
+			if now >= start_time + (run + 1) * run_length and run < reheats:
+				run += 1
+				self._setTour( best_tour.copy() )
+			done = min( (now - start_time - run * run_length) / run_length, 1.0 )
+			if schedule == 'exponential':
+				temperature = hot * (cold / hot) ** done
+			else:
+				temperature = hot + (cold - hot) * done
+
+			self._step( temperature, batch_size )
+			if self.cost < best_cost:
+				best_cost, best_tour = self.cost, self._tour.copy()
+				yield best_cost, best_tour
+
+	# Temperature at which the median uphill move from the current tour is accepted
+	# with probability START_ACCEPTANCE
+	def _startTemperature( self, batch_size ):
+		moves = self._propose( batch_size )
+		delta = moves[-1]
+		uphill = delta[(delta > 0) & (delta < self.MISSING_EDGE // 2)]
+		if not len(uphill):
+			return 1.0
+		return float( np.median(uphill) ) / -math.log( self.START_ACCEPTANCE )
+
+	# Proposes, scores and applies one batch of moves at the given temperature
+	def _step( self, temperature, batch_size ):
+		two_opt, lo, hi, m, delta = self._propose( batch_size )
+		# Metropolis: accept when delta < -T ln(u), which always holds for a downhill move
+		threshold = -temperature * np.log( 1.0 - self._rng.random( len(delta) ) )
+		accept = np.flatnonzero( delta < threshold )
+		self.proposed += len(delta)
+		if not len(accept):
+			return
+
+		tour = self._tour
+		applied = []
+		for k in accept.tolist():
+			a, b = int(lo[k]), int(hi[k])
+			wraps = b >= self._n
+			if applied and (wraps or any( a < end and start < b for start, end in applied )):
+				continue
+			if wraps:
+				# Rotate so the window starts at 0; every other window moves, so stop after this one
+				tour = np.roll( tour, -a )
+				a, b = 0, b - a
+			if two_opt[k]:
+				tour[a+1:b] = tour[a+1:b][::-1].copy()
+			else:
+				s = int(m[k])
+				tour[a+1:b] = np.concatenate( (tour[a+1+s:b], tour[a+1:a+1+s]) )
+			applied.append( (a, b) )
+			self.cost += int(delta[k])
+			if wraps:
+				break
+
+		self.accepted += len(applied)
+		self._setTour( tour )
+
+	''' <summary>
+		Draws and scores batch_size random moves.  Each move is described by its
+		window of tour positions lo..hi (hi may run past the end of the array),
+		whose end cities stay put while the span cities strictly between change:
+		  2-opt:  a = tour[lo] takes candidate c as its successor, reversing b..c
+		  Or-opt: the m cities first..last from lo+1 move between c and d, where
+		          d = tour[hi] is a candidate successor for last
+		</summary>
+		<returns>two_opt flags, lo, hi, m and delta (the change in tour cost) for
+		each usable move; moves that are not usable are dropped</returns> '''
+	def _propose( self, batch_size ):
+		n, t, pos, C = self._n, self._tour, self._pos, self._costs
+		draws = self._rng.random( (4, batch_size) )
+		two_opt = draws[0] < self.TWO_OPT_SHARE
+		cities = (draws[1] * n).astype(np.intp)
+		m = np.where( two_opt, 0, 1 + (draws[2] * self.OR_OPT_LENGTH).astype(np.intp) )
+		picks = (draws[3] * self._counts[cities]).astype(np.intp)
+		target = self._table[cities, picks]
+
+		# The drawn city is a for 2-opt and last for Or-opt
+		lo = (pos[cities] - m) % n
+		span = np.where( two_opt, pos[target] - lo, pos[target] - lo - 1 ) % n
+		hi = lo + span + 1
+		usable = (self._counts[cities] > 0) & (span <= n - 2) & np.where( two_opt, span >= 2, span > m )
+
+		a, b = t[lo], t[(lo + 1) % n]
+		c, d = t[(hi - 1) % n], t[hi % n]
+		last, f = t[(lo + m) % n], t[(lo + m + 1) % n]
+		fwd, bwd = self._pathSums( (lo + 1) % n, span )
+		delta = np.where( two_opt,
+						  C[a, c] + C[b, d] - C[a, b] - C[c, d] + bwd - fwd,
+						  C[a, f] + C[c, b] + C[last, d] - C[a, b] - C[last, f] - C[c, d] )
+		return two_opt[usable], lo[usable], hi[usable], m[usable], delta[usable]
+
+	# Costs of the tour paths of the given lengths starting at the given positions,
+	# walked forwards and backwards; a path may wrap past the end of the tour
+	def _pathSums( self, starts, lengths ):
+		n, t, C = self._n, self._tour, self._costs
+		ends = starts + lengths - 1
+		wrap = ends >= n
+		ends %= n
+		closing_fwd = self._fwd[n-1] + C[t[n-1], t[0]]
+		closing_bwd = self._bwd[n-1] + C[t[0], t[n-1]]
+		fwd = self._fwd[ends] - self._fwd[starts] + np.where( wrap, closing_fwd, 0 )
+		bwd = self._bwd[ends] - self._bwd[starts] + np.where( wrap, closing_bwd, 0 )
+		return fwd, bwd
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import math
+import sys
+import traceback
+
+import numpy as np
+
+from TSPClasses import Scenario, newPoints
+from TSPSolver import TSPSolver
+
+
+
+
+''' <summary>
+	Command-line batch runner: solves every combination of the given sizes,
+	seeds, difficulties, algorithms and time limits with no GUI, writing one
+	JSON line or CSV row per run as each run finishes.  For example
+
+	  python3 TSPBatch.py --sizes 10:50:10 --seeds 0:9
+	      --difficulties Easy "Hard (Deterministic)"
+	      --algorithms greedy "Branch and Bound" --time-limits 10 60 --workers 4
+
+	Sizes and seeds take single numbers and inclusive ranges start:stop or
+	start:stop:step.  Algorithms are named by their GUI label or by their
+	TSPSolver method (see TSPSolver.ALGORITHMS); 'all' runs every one.
+
+	Each run gets the cities the GUI would generate for its size and seed (see
+	TSPClasses.newPoints), and np.random is seeded with the seed before the
+	instance is built, so Hard mode and the randomized algorithms repeat from
+	one sweep to the next.  With --workers above one the runs are spread over
+	that many processes and rows come out in the order runs finish; the timings
+	then share the machine, so the algorithms' own workers (genetic) may be
+	worth limiting with fewer runs at once.
+	</summary> '''
+
+FIELDS = ['size', 'seed', 'difficulty', 'algorithm', 'time_limit', \
+		  'cost', 'time', 'count', 'max', 'total', 'pruned', 'error']
+RESULT_FIELDS = ('cost', 'time', 'count', 'max', 'total', 'pruned')
+
+
+
+
+# Integers from tokens that are numbers or inclusive ranges start:stop[:step]
+def parseIntegers( tokens ):
+	values = []
+	for token in tokens:
+		parts = [int(part) for part in token.split(':')]
+		if len(parts) == 1:
+			values.append( parts[0] )
+		elif len(parts) in (2, 3) and (len(parts) == 2 or parts[2] > 0):
+			step = parts[2] if len(parts) == 3 else 1
+			values.extend( range(parts[0], parts[1] + 1, step) )
+		else:
+			raise ValueError('Unsupported range: {}'.format(token))
+	return values
+
+# TSPSolver method names for algorithm labels or method names, 'all' for every one
+def parseAlgorithms( names ):
+	byName = {}
+	for label, method in TSPSolver.ALGORITHMS:
+		byName[label.lower()] = method
+		byName[method.lower()] = method
+	methods = []
+	for name in names:
+		if name.lower() == 'all':
+			methods.extend( method for _, method in TSPSolver.ALGORITHMS )
+		elif name.lower() in byName:
+			methods.append( byName[name.lower()] )
+		else:
+			raise ValueError('Unsupported algorithm: {}'.format(name))
+	return methods
+
+def parseDifficulties( names ):
+	byName = { difficulty.lower(): difficulty for difficulty in Scenario.DIFFICULTIES }
+	difficulties = []
+	for name in names:
+		if name.lower() == 'all':
+			difficulties.extend( Scenario.DIFFICULTIES )
+		elif name.lower() in byName:
+			difficulties.append( byName[name.lower()] )
+		else:
+			raise ValueError('Unsupported difficulty: {}'.format(name))
+	return difficulties
+
+
+
+''' <summary>
+	Builds the instance for one run and solves it.
+	</summary>
+	<returns>a row of FIELDS, with an infinite cost (no tour found) as None and
+	error None</returns> '''
+def runOne( size, seed, difficulty, algorithm, time_limit, seed_version=Scenario.SEED_VERSION ):
+	xs, ys = newPoints( size, seed )
+	np.random.seed( seed )
+	scenario = Scenario.fromCoordinates( xs, ys, difficulty, seed, seed_version=seed_version )
+	solver = TSPSolver()
+	solver.setupWithScenario( scenario )
+	results = solver.solve( algorithm, time_allowance=time_limit )
+
+	row = { 'size': size, 'seed': seed, 'difficulty': difficulty, 'algorithm': algorithm, \
+			'time_limit': time_limit }
+	for field in RESULT_FIELDS:
+		value = results.get( field )
+		if isinstance(value, (np.integer, np.floating)):
+			value = value.item()
+		if isinstance(value, float) and math.isinf(value):
+			value = None
+		row[field] = value
+	row['error'] = None
+	return row
+
+def _runTask( task ):
+	try:
+		return runOne( *task )
+	except Exception:
+		return _failedRow( task, traceback.format_exc() )
+
+# A row for a run that raised or whose process died, with the reason in error
+def _failedRow( task, error ):
+	row = dict( zip(FIELDS, task[:5]) )
+	row.update( { field: None for field in RESULT_FIELDS } )
+	row['error'] = error
+	return row
+
+''' <summary>
+	Runs every task, yielding each row as it finishes.  A run that raises, or
+	whose worker process dies, yields a row with error set instead of ending the
+	sweep; an interrupt cancels the runs not yet started.
+	</summary> '''
+def runAll( tasks, workers=1 ):
+	if workers <= 1:
+		for task in tasks:
+			yield _runTask( task )
+		return
+	with concurrent.futures.ProcessPoolExecutor( max_workers=workers ) as pool:
+		futures = { pool.submit(_runTask, task): task for task in tasks }
+		try:
+			for future in concurrent.futures.as_completed( futures ):
+				try:
+					yield future.result()
+				except Exception as error:
+					yield _failedRow( futures[future], '{}: {}'.format(type(error).__name__, error) )
+		except KeyboardInterrupt:
+			for future in futures:
+				future.cancel()
+			raise
+
+
+
+# Writes rows to a stream as JSON lines or CSV, flushing after each
+class RowWriter:
+
+	FORMATS = ('json', 'csv')
+
+	def __init__( self, stream, format='json' ):
+		if format not in self.FORMATS:
+			raise ValueError('Unsupported output format: {}'.format(format))
+		self._stream = stream
+		self._csv = None
+		if format == 'csv':
+			self._csv = csv.DictWriter( stream, fieldnames=FIELDS )
+			self._csv.writeheader()
+
+	def write( self, row ):
+		if self._csv is not None:
+			self._csv.writerow( row )
+		else:
+			self._stream.write( json.dumps(row) + '\n' )
+		self._stream.flush()
+
+
+
+def main( argv=None ):
+	parser = argparse.ArgumentParser( description='Solve batches of TSP instances without the GUI.' )
+	parser.add_argument( '--sizes', nargs='+', required=True, help='city counts: N or start:stop[:step]' )
+	parser.add_argument( '--seeds', nargs='+', default=['20'], help='random seeds: N or start:stop[:step]' )
+	parser.add_argument( '--difficulties', nargs='+', default=['Hard (Deterministic)'], \
+						 help='difficulty names, or all' )
+	parser.add_argument( '--algorithms', nargs='+', default=['fancy'], \
+						 help='GUI labels or TSPSolver method names, or all' )
+	parser.add_argument( '--time-limits', nargs='+', type=float, default=[60.0], help='seconds per run' )
+	parser.add_argument( '--seed-version', type=int, default=Scenario.SEED_VERSION, \
+						 help='Hard (Deterministic) seed version' )
+	parser.add_argument( '--workers', type=int, default=1, help='runs at once, each in its own process' )
+	parser.add_argument( '--format', choices=RowWriter.FORMATS, default='json' )
+	parser.add_argument( '--output', help='file to write rows to instead of standard output' )
+	args = parser.parse_args( argv )
+
+	try:
+		sizes = parseIntegers( args.sizes )
+		seeds = parseIntegers( args.seeds )
+		difficulties = parseDifficulties( args.difficulties )
+		algorithms = parseAlgorithms( args.algorithms )
+	except ValueError as error:
+		parser.error( str(error) )
+
+	tasks = [ task + (args.seed_version,) for task in \
+			  itertools.product( sizes, seeds, difficulties, algorithms, args.time_limits ) ]
+	stream = open( args.output, 'w', newline='' ) if args.output else sys.stdout
+	try:
+		writer = RowWriter( stream, args.format )
+		for row in runAll( tasks, args.workers ):
+			writer.write( row )
+	finally:
+		if stream is not sys.stdout:
+			stream.close()
+
+
+if __name__ == '__main__':
+	main()
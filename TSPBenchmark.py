@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from TSPBatch import runOne
+from TSPClasses import Scenario
+from TSPSolver import TSPSolver
+
+try:
+	import resource
+except ImportError: # Unix only; peak RSS is then reported as None
+	resource = None
+
+
+
+
+''' <summary>
+	Benchmark suite: runs every solver over a fixed set of instances and
+	records, per run, wall time, tour cost, the gap to the best tour known for
+	the instance, the peak RSS of the run (None where the resource module is
+	missing, as on Windows) and the states (or moves, offspring) per second the
+	solver reports through its 'total' field.
+
+	A suite is a list of sizes, seeds and time limits over all four
+	difficulties; every instance comes from TSPBatch.runOne, so the same size,
+	seed and difficulty give the same cities and edges on every machine.
+	Algorithms are not run past their MAX_CITIES.  Each run is a fresh process
+	so peak RSS is its own.  A run that overruns its time limit by far is
+	stopped and its row has timeout set; one that raises or whose process dies
+	has error set to the traceback or exit code instead.
+
+	  python3 TSPBenchmark.py --suite quick --save baselines/quick.json
+	  python3 TSPBenchmark.py --suite quick --compare
+	  python3 TSPBenchmark.py --load baselines/full.json --plot scaling.png
+
+	--save writes the rows with the suite, FORMAT_VERSION, git commit and
+	platform, so baselines from different code can be kept side by side.
+	--compare checks a run against a baseline, by default the one kept in the
+	repository for the suite (baselines/<suite>.json), and exits with status 1
+	when a run regresses: it fails or overruns, its cost rises by more than
+	COST_THRESHOLD, or, for a run that finished before its time limit, its time
+	rises by more than TIME_THRESHOLD and MIN_TIME_CHANGE seconds.  The ANYTIME
+	solvers always use their whole time limit, so only their cost is checked.
+	The best known cost of an instance is the lowest any algorithm found in
+	this run or the baseline.
+	--plot draws time against n for each algorithm, one panel per difficulty
+	(matplotlib is only needed for this).
+	</summary> '''
+
+FORMAT_VERSION = 1 # Layout of saved baselines; bump when the row fields change
+
+SUITES = { \
+	'quick': { 'sizes': [10, 20, 50, 100], 'seeds': [1], 'time_limit': 2.0 }, \
+	'full':  { 'sizes': [10, 15, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000], 'seeds': [1, 2, 3], \
+			   'time_limit': 60.0 }, \
+}
+
+MAX_CITIES = { # Largest instance each algorithm is benchmarked on
+	'defaultRandomTour': 200, \
+	'branchAndBound': 50, \
+	'heldKarp': 20, \
+	'cheapestInsertion': 5000, \
+	'farthestInsertion': 5000, \
+}
+
+COST_THRESHOLD = 0.02 # Relative rise in tour cost that counts as a regression
+TIME_THRESHOLD = 0.25 # Relative rise in time that counts as a regression
+MIN_TIME_CHANGE = 0.05 # Seconds a time must also rise by, so timer noise on fast runs is ignored
+OVERRUN_GRACE = 2.0 # A run is stopped after this many times its time limit, plus a minute
+RESULT_WAIT = 0.1 # Seconds between checks on a running benchmark process
+BASELINE_DIR = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'baselines' ) # Baselines kept with the code
+
+ANYTIME = ('iteratedLocalSearch', 'simulatedAnnealing', 'genetic') # Solvers that run until the time limit
+
+
+
+
+# Runs one benchmark case and puts its row, with peak RSS, on the queue; an
+# exception is sent back as a failed row
+def _measure( case, results ):
+	started = time.time()
+	try:
+		row = runOne( *case )
+		row['peak_rss_mb'] = _peakRss()
+		row['timeout'], row['error'] = False, None
+	except Exception:
+		row = _failedRow( case, time.time() - started, error=traceback.format_exc() )
+	results.put( row )
+
+# Peak RSS of this process in MB, or None where it cannot be read
+def _peakRss():
+	if resource is None:
+		return None
+	peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+	# Linux reports kilobytes, macOS bytes
+	return peak / 1024.0**2 if sys.platform == 'darwin' else peak / 1024.0
+
+# A row for a run that has no results
+def _failedRow( case, elapsed, error=None, timeout=False ):
+	size, seed, difficulty, algorithm, time_limit = case
+	return { 'size': size, 'seed': seed, 'difficulty': difficulty, 'algorithm': algorithm, \
+			 'time_limit': time_limit, 'cost': None, 'time': elapsed, 'count': None, 'max': None, \
+			 'total': None, 'pruned': None, 'peak_rss_mb': None, 'timeout': timeout, 'error': error }
+
+''' <summary>
+	Runs one case in its own process.
+	</summary>
+	<returns>the run's row: timeout is True if it overran and had to be stopped,
+	error is set if it raised (the traceback) or its process died (the exit
+	code)</returns> '''
+def runCase( case ):
+	time_limit = case[4]
+	context = multiprocessing.get_context()
+	results = context.Queue()
+	process = context.Process( target=_measure, args=(case, results) )
+	started = time.time()
+	process.start()
+	row = None
+	while row is None:
+		try:
+			row = results.get( timeout=RESULT_WAIT )
+		except queue.Empty:
+			if process.exitcode is not None:
+				# It may have exited just after sending its row
+				try:
+					row = results.get( timeout=RESULT_WAIT )
+				except queue.Empty:
+					row = _failedRow( case, time.time() - started, \
+									  error='process exited with code {}'.format(process.exitcode) )
+			elif time.time() > started + OVERRUN_GRACE * time_limit + 60.0:
+				process.terminate()
+				row = _failedRow( case, time.time() - started, timeout=True )
+	process.join()
+	total = row['total']
+	row['states_per_sec'] = total / row['time'] if isinstance(total, int) and row['time'] > 0 else None
+	return row
+
+# Every (size, seed, difficulty, algorithm, time_limit) in a suite
+def suiteCases( suite, algorithms ):
+	spec = SUITES[suite]
+	return [ (size, seed, difficulty, algorithm, spec['time_limit']) \
+			 for size in spec['sizes'] for seed in spec['seeds'] \
+			 for difficulty in Scenario.DIFFICULTIES for algorithm in algorithms \
+			 if size <= MAX_CITIES.get(algorithm, size) ]
+
+def _instance( row ):
+	return (row['size'], row['seed'], row['difficulty'])
+
+def _run( row ):
+	return _instance(row) + (row['algorithm'],)
+
+# Sets each row's gap to the lowest cost found for its instance in rows or baseline
+def addGaps( rows, baseline=() ):
+	best = {}
+	for row in list(rows) + list(baseline):
+		if row['cost'] is not None:
+			best[_instance(row)] = min( best.get(_instance(row), math.inf), row['cost'] )
+	for row in rows:
+		known = best.get( _instance(row) )
+		row['gap'] = row['cost'] / known - 1.0 if row['cost'] is not None and known else None
+
+
+
+''' <summary>
+	Compares rows with the rows of a baseline run of the same cases.
+	</summary>
+	<returns>a list of (row, reason) for every run that regressed</returns> '''
+def regressions( rows, baseline ):
+	before = { _run(row): row for row in baseline }
+	found = []
+	for row in rows:
+		old = before.get( _run(row) )
+		if old is None or old['timeout'] or old.get('error'):
+			continue
+		if row['timeout']:
+			found.append( (row, 'stopped after {:.1f}s'.format(row['time'])) )
+		elif row.get('error'):
+			found.append( (row, 'failed: {}'.format(row['error'].strip().splitlines()[-1])) )
+		elif row['cost'] is None and old['cost'] is not None:
+			found.append( (row, 'no tour, was {}'.format(old['cost'])) )
+		elif row['cost'] is not None and old['cost'] is not None and \
+			 row['cost'] > old['cost'] * (1.0 + COST_THRESHOLD):
+			found.append( (row, 'cost {} was {}'.format(row['cost'], old['cost'])) )
+		elif row['algorithm'] not in ANYTIME and old['time'] < 0.9 * old['time_limit'] and \
+			 row['time'] > old['time'] * (1.0 + TIME_THRESHOLD) and row['time'] - old['time'] > MIN_TIME_CHANGE:
+			found.append( (row, 'time {:.3f}s was {:.3f}s'.format(row['time'], old['time'])) )
+	return found
+
+def _gitCommit():
+	try:
+		return subprocess.run( ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, \
+							   cwd=os.path.dirname(os.path.abspath(__file__)) ).stdout.strip() or None
+	except OSError:
+		return None
+
+def saveBaseline( path, suite, rows ):
+	data = { 'format': FORMAT_VERSION, 'suite': suite, 'commit': _gitCommit(), 'created': time.time(), \
+			 'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.platform(), \
+			 'cpus': os.cpu_count(), 'rows': rows }
+	if os.path.dirname(path):
+		os.makedirs( os.path.dirname(path), exist_ok=True )
+	with open( path, 'w' ) as file:
+		json.dump( data, file, indent=1 )
+
+def loadBaseline( path ):
+	with open( path ) as file:
+		data = json.load( file )
+	if data.get('format') != FORMAT_VERSION:
+		raise ValueError('Unsupported baseline format: {}'.format(data.get('format')))
+	return data
+
+
+
+''' <summary>
+	Plots the median time of each algorithm against n, log-log, with a panel
+	per difficulty, to show where each one stops scaling.
+	</summary> '''
+def plotScaling( rows, path ):
+	import matplotlib
+	matplotlib.use( 'Agg' )
+	import matplotlib.pyplot as plt
+
+	difficulties = [ difficulty for difficulty in Scenario.DIFFICULTIES \
+					 if any(row['difficulty'] == difficulty for row in rows) ]
+	figure, axes = plt.subplots( 1, len(difficulties), figsize=(5 * len(difficulties), 4.5), squeeze=False )
+	for axis, difficulty in zip( axes[0], difficulties ):
+		for _, algorithm in TSPSolver.ALGORITHMS:
+			times = {}
+			for row in rows:
+				if row['difficulty'] == difficulty and row['algorithm'] == algorithm and \
+				   not row['timeout'] and not row.get('error'):
+					times.setdefault( row['size'], [] ).append( row['time'] )
+			if times:
+				sizes = sorted( times )
+				axis.plot( sizes, [statistics.median(times[size]) for size in sizes], marker='o', label=algorithm )
+		axis.set_xscale( 'log' )
+		axis.set_yscale( 'log' )
+		axis.set_title( difficulty )
+		axis.set_xlabel( 'cities' )
+		axis.set_ylabel( 'seconds' )
+	axes[0][-1].legend( fontsize='small' )
+	figure.tight_layout()
+	figure.savefig( path )
+	plt.close( figure )
+
+
+
+def _report( row, stream ):
+	fields = [ '{:>6}'.format(row['size']), '{:>3}'.format(row['seed']), '{:<20}'.format(row['difficulty']), \
+			   '{:<20}'.format(row['algorithm']), '{:>10.3f}s'.format(row['time']), \
+			   '{:>10}'.format('-' if row['cost'] is None else row['cost']), \
+			   '{:>8}'.format('-' if row['peak_rss_mb'] is None else '{:.0f}MB'.format(row['peak_rss_mb'])) ]
+	if row['timeout']:
+		fields.append( 'stopped' )
+	elif row.get('error'):
+		fields.append( 'failed: ' + row['error'].strip().splitlines()[-1] )
+	stream.write( ' '.join(fields) + '\n' )
+	stream.flush()
+
+def main( argv=None ):
+	parser = argparse.ArgumentParser( description='Benchmark the TSP solvers.' )
+	parser.add_argument( '--suite', choices=sorted(SUITES), default='quick' )
+	parser.add_argument( '--algorithms', nargs='+', default=[method for _, method in TSPSolver.ALGORITHMS], \
+						 help='TSPSolver method names (default: all)' )
+	parser.add_argument( '--load', help='use the rows of a saved run instead of running the suite' )
+	parser.add_argument( '--save', help='file to save the run to, as a baseline' )
+	parser.add_argument( '--compare', nargs='?', const='', \
+						 help='baseline to check the run against for regressions (default: baselines/SUITE.json)' )
+	parser.add_argument( '--plot', help='image file for the time against n plot' )
+	args = parser.parse_args( argv )
+
+	methods = [ method for _, method in TSPSolver.ALGORITHMS ]
+	for algorithm in args.algorithms:
+		if algorithm not in methods:
+			parser.error( 'Unsupported algorithm: {}'.format(algorithm) )
+	if args.compare == '':
+		args.compare = os.path.join( BASELINE_DIR, args.suite + '.json' )
+	try:
+		baseline = loadBaseline( args.compare )['rows'] if args.compare else []
+	except (ValueError, OSError) as error:
+		parser.error( str(error) )
+	if args.plot:
+		try:
+			import matplotlib
+		except ImportError:
+			parser.error( '--plot needs matplotlib' )
+
+	if args.load:
+		rows = loadBaseline( args.load )['rows']
+	else:
+		rows = []
+		for case in suiteCases( args.suite, args.algorithms ):
+			rows.append( runCase(case) )
+			_report( rows[-1], sys.stderr )
+	addGaps( rows, baseline )
+
+	if args.save:
+		saveBaseline( args.save, args.suite, rows )
+	if args.plot:
+		plotScaling( rows, args.plot )
+	if args.compare:
+		found = regressions( rows, baseline )
+		for row, reason in found:
+			sys.stdout.write( 'REGRESSION {} {} {} {}: {}\n'.format( row['algorithm'], row['size'], row['seed'], \
+																		 row['difficulty'], reason ) )
+		sys.stdout.write( '{} runs, {} regressions\n'.format(len(rows), len(found)) )
+		return 1 if found else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit( main() )
@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+
+
+import abc
+import math
+import numpy as np
+import time
+
+
+
+
+''' <summary>
+	Lower bounds for TSPSolver.branchAndBound.
+
+	Each bound is a class built around the scenario's cost matrix with two methods:
+	  root( upper, deadline )            -> (bound, data) for the state holding only the start city
+	  children( state, upper, deadline ) -> (dest, bound, data) for every city the state can visit next
+	'upper' is the current BSSF cost, and 'data' is whatever the bound needs to
+	expand that child later; it is kept on the bbState as boundData.  stateBytes
+	estimates how much memory that data takes per queued state.  Once the
+	deadline (a time.time() value, or None for none) passes, children stops
+	yielding and the Lagrangian ascent stops with the best bound it has so far.
+
+	Except for the incremental reduced-cost bound, the bounds work on the
+	"contracted" sub-problem of a partial route: the route first -> ... -> last
+	is merged into one node whose outgoing costs are those of 'last' and whose
+	incoming costs are those of 'first'.  Any tour of that smaller asymmetric
+	problem is exactly a completion of the route, so a lower bound on it plus the
+	cost of the route is a lower bound on every tour below the state.
+	</summary> '''
+
+
+
+
+# True once the deadline, if there is one, has passed
+def _expired( deadline ):
+	return deadline is not None and time.time() > deadline
+
+# Tour costs are whole numbers, so any real-valued lower bound can be rounded up.
+# The tolerance keeps floating point noise from rounding a bound past the optimum.
+def _roundUp( bound ):
+	if bound == np.inf:
+		return bound
+	return math.ceil( bound - 1e-6 )
+
+# The cities a state has not visited yet, in index order
+def _unvisited( state, ncities ):
+	return np.array( [i for i in range(ncities) if not state.hasVisited(i)], dtype=np.intp )
+
+# Cost matrix of the sub-problem left once the route first -> ... -> last is fixed:
+# node 0 stands for the whole route, leaving from 'last' and arriving at 'first'
+def contractedMatrix( costs, first, last, unvisited ):
+	nodes = np.concatenate( ([last], unvisited) )
+	mat = costs[np.ix_(nodes, nodes)]
+	mat[1:, 0] = costs[unvisited, first]
+	mat[0, 0] = np.inf
+	return mat
+
+
+
+''' <summary>
+	Row/column reduction bound (the original branch-and-bound bound).  Children
+	are bounded incrementally from their parent's reduced matrix, and a state's
+	data is its accumulated row and column reductions (a 2 x N array), from which
+	its reduced matrix is rebuilt when it is expanded.
+	</summary> '''
+class ReducedCostBound:
+
+	name = 'reduction'
+
+	def __init__( self, costs ):
+		self._costs = costs
+
+	def stateBytes( self, ncities ):
+		return 2 * ncities * 8
+
+	def root( self, upper, deadline=None ):
+		return self.calcLowerBound( self._costs.copy() )
+
+	def children( self, state, upper, deadline=None ):
+		# N^2 time, but only one matrix is alive at a time instead of one per queued state
+		stateMat = self.rebuildMatrix( state )
+
+		# Worst Case: N-1 Matricies to generate, Log N average
+		for dest in range( len(stateMat) ):
+			if _expired( deadline ):
+				return
+			if not state.hasVisited(dest): # O(1) bitmask check
+				childCities = stateMat.copy() # N^2 Time, discarded once the bound is known
+
+				# calcChild is an N^2 Time, 1 Space function
+				additionalCost, childReductions = self.calcChild( childCities, state.city, dest )
+				if childReductions is not None:
+					childReductions += state.boundData
+				yield dest, state.lowerBound + additionalCost, childReductions
+
+	# Takes in a city matrix and calculates the lower bound value
+	# Returns the lower bound cost and the row and column reductions applied
+	# Subtracts each row's minimum from the row, then each column's minimum from the column;
+	# rows and columns that are entirely infinity are left alone
+	# TIME: 4 * N^2 = N^2, as a handful of vectorized passes
+	# SPACE: Works in place, plus a 2 x N array of reductions
+	def calcLowerBound( self, mat ):
+		reductions = np.empty((2, len(mat)))
+		rowMin, colMin = reductions
+
+		rowMin[:] = mat.min(axis=1)
+		rowMin[rowMin == np.inf] = 0
+		mat -= rowMin[:, np.newaxis]
+
+		colMin[:] = mat.min(axis=0)
+		colMin[colMin == np.inf] = 0
+		mat -= colMin[np.newaxis, :]
+
+		return reductions.sum(), reductions
+
+	# Calculates the additional costs related to travelling
+	# from the source city to destination city in given matrix
+	# Masks the source row, destination column and the reverse edge in place
+	# Calls the N^2 time lower bound update
+	# TIME: N^2 because of bound update
+	# SPACE: Works in place
+	def calcChild( self, cities, source, dest ):
+		travelCost = cities[source, dest]
+		if travelCost == np.inf: return float('inf'), None
+
+		cities[:, dest] = np.inf
+		cities[source, :] = np.inf
+		cities[dest, source] = np.inf
+		bound, reductions = self.calcLowerBound(cities) # N^2 time
+
+		return travelCost + bound, reductions
+
+	# Rebuilds a state's reduced cost matrix from the original cost matrix
+	# Masking only ever sets entries to infinity and reducing only subtracts a row
+	# or column constant, so masking every edge of the route and then subtracting
+	# the accumulated reductions gives exactly the matrix the search would have built
+	# TIME: N * depth + N^2
+	# SPACE: N^2, only for the state being expanded
+	def rebuildMatrix( self, state ):
+		cities = self._costs.copy()
+		route = state.getRoute()
+		for source, dest in zip(route, route[1:]):
+			cities[:, dest] = np.inf
+			cities[source, :] = np.inf
+			cities[dest, source] = np.inf
+		rowReduction, colReduction = state.boundData
+		cities -= rowReduction[:, np.newaxis]
+		cities -= colReduction[np.newaxis, :]
+		return cities
+
+
+
+''' <summary>
+	Base for the bounds that solve a relaxation of each child's contracted
+	sub-problem from scratch.  A state's data starts with the cost of its route.
+	Subclasses implement relaxation.
+	</summary> '''
+class ContractedBound( abc.ABC ):
+
+	def __init__( self, costs ):
+		self._costs = costs
+		self._ncities = len(costs)
+
+	def stateBytes( self, ncities ):
+		return 8
+
+	def root( self, upper, deadline=None ):
+		bound, data = self.relaxation( self._costs, upper, None, deadline=deadline )
+		return _roundUp( bound ), (0.0, data)
+
+	def children( self, state, upper, deadline=None ):
+		costs = self._costs
+		first = state.getRoute()[0]
+		pathCost, data = state.boundData
+		unvisited = _unvisited( state, self._ncities )
+
+		for dest in unvisited:
+			if _expired( deadline ):
+				return
+			childPath = pathCost + costs[state.city, dest]
+			if childPath == np.inf:
+				yield dest, np.inf, None
+				continue
+
+			remaining = unvisited[unvisited != dest]
+			if len(remaining) == 0:
+				# The route is a whole tour, so its cost is exact
+				yield dest, childPath + costs[dest, first], (childPath, None)
+				continue
+
+			mat = contractedMatrix( costs, first, dest, remaining )
+			bound, childData = self.relaxation( mat, upper - childPath, data, \
+												np.concatenate( ([dest], remaining) ), deadline )
+			yield dest, _roundUp( childPath + bound ), (childPath, childData)
+
+	# Lower bound on the cheapest tour through the contracted matrix mat (see
+	# contractedMatrix), given the parent state's data and each row's original city
+	# (nodes, None at the root); iterative relaxations stop early at the deadline
+	# Returns the bound and the data to keep for the state's children
+	@abc.abstractmethod
+	def relaxation( self, mat, upper, data, nodes=None, deadline=None ):
+		pass
+
+
+
+''' <summary>
+	Assignment-problem bound: the cheapest way to give every node exactly one
+	successor and one predecessor, ignoring subtours.  Solved exactly with the
+	Hungarian algorithm (shortest augmenting paths with potentials), with the
+	scan over columns vectorized.  Never weaker than the reduction bound.
+	</summary> '''
+class AssignmentBound( ContractedBound ):
+
+	name = 'assignment'
+
+	def relaxation( self, mat, upper, data, nodes=None, deadline=None ):
+		return assignmentCost( mat ), None
+
+# Minimum cost assignment of rows to columns, or infinity if every assignment
+# needs a missing edge
+# TIME: N^3, with the inner N loop vectorized
+# SPACE: N
+def assignmentCost( mat ):
+	n = len(mat)
+	finite = mat < np.inf
+	if not finite.any(axis=1).all() or not finite.any(axis=0).all():
+		return np.inf
+
+	# Stand-in for missing edges, dearer than any assignment of real edges
+	big = mat[finite].max() * n + 1
+	cost = np.where( finite, mat, big )
+
+	# Row potentials u, column potentials v; p[j] is the row matched to column j
+	# Index 0 is a dummy column used to start each augmenting path
+	u = np.zeros(n+1)
+	v = np.zeros(n+1)
+	p = np.zeros(n+1, dtype=np.intp)
+	way = np.zeros(n+1, dtype=np.intp)
+	for row in range(1, n+1):
+		p[0] = row
+		j0 = 0
+		minv = np.full(n+1, np.inf)
+		used = np.zeros(n+1, dtype=bool)
+		while True:
+			used[j0] = True
+			i0 = p[j0]
+			free = ~used[1:]
+			reduced = cost[i0-1] - u[i0] - v[1:]
+			better = free & (reduced < minv[1:])
+			minv[1:][better] = reduced[better]
+			way[1:][better] = j0
+
+			j1 = np.argmin( np.where(free, minv[1:], np.inf) ) + 1
+			delta = minv[j1]
+			u[p[used]] += delta
+			v[used] -= delta
+			minv[~used] -= delta
+			j0 = j1
+			if p[j0] == 0:
+				break
+		# Flip the augmenting path
+		while j0:
+			j1 = way[j0]
+			p[j0] = p[j1]
+			j0 = j1
+
+	total = -v[0]
+	if total >= big:
+		return np.inf
+	return total
+
+
+
+''' <summary>
+	Lagrangian 1-arborescence bound (the asymmetric counterpart of the Held-Karp
+	1-tree bound).  A 1-arborescence is a spanning arborescence rooted at node 0
+	plus the cheapest edge back into node 0: every node has exactly one incoming
+	edge, and every tour is one.  Out-degrees are relaxed with multipliers pi
+	(edge i -> j costs c[i,j] + pi[i]) and subgradient ascent on pi raises the
+	bound.  The root state runs ROOT_ITERATIONS of ascent; children warm-start
+	from their parent's multipliers and run CHILD_ITERATIONS.
+	</summary> '''
+class ArborescenceBound( ContractedBound ):
+
+	name = 'arborescence'
+
+	ROOT_ITERATIONS = 100
+	CHILD_ITERATIONS = 5
+	INITIAL_STEP = 2.0 # Polyak step scale, halved whenever the bound stalls
+	STALL_ITERATIONS = 5
+
+	def stateBytes( self, ncities ):
+		return 8 + ncities * 8
+
+	def relaxation( self, mat, upper, data, nodes=None, deadline=None ):
+		# Multipliers are kept per city so they can follow a city into a child's sub-problem
+		if data is None:
+			multipliers = np.zeros( self._ncities )
+			iterations = self.ROOT_ITERATIONS
+		else:
+			multipliers = data.copy()
+			iterations = self.CHILD_ITERATIONS
+		if nodes is None:
+			nodes = np.arange( self._ncities )
+
+		pi = multipliers[nodes]
+		bound, pi = lagrangianArborescence( mat, upper, pi, iterations, self.INITIAL_STEP, \
+											self.STALL_ITERATIONS, deadline )
+		multipliers[nodes] = pi
+		return bound, multipliers
+
+# Subgradient ascent on the out-degree multipliers of the 1-arborescence bound
+# Returns the best bound found and the multipliers that gave it; past the deadline
+# it stops after the current iteration, since every iteration's bound is valid
+# TIME: iterations * (cost of minArborescence)
+def lagrangianArborescence( mat, upper, pi, iterations, step, stall, deadline=None ):
+	n = len(mat)
+	best, bestPi = -np.inf, pi
+	sinceBest = 0
+	for _ in range( max(iterations, 1) ):
+		weights = mat + pi[:, np.newaxis]
+		treeCost, parent = minArborescence( weights, 0 )
+		if parent is None:
+			return np.inf, pi # some node cannot be reached at all
+		into0 = np.argmin( weights[:, 0] )
+		if weights[into0, 0] == np.inf:
+			return np.inf, pi
+		bound = treeCost + weights[into0, 0] - pi.sum()
+
+		if bound > best:
+			best, bestPi = bound, pi.copy()
+			sinceBest = 0
+		else:
+			sinceBest += 1
+			if sinceBest >= stall:
+				step /= 2
+				sinceBest = 0
+
+		outDegree = np.bincount( parent[1:], minlength=n )
+		outDegree[into0] += 1
+		gradient = outDegree - 1
+		norm = gradient @ gradient
+		if norm == 0 or best >= upper or _expired( deadline ):
+			break # the 1-arborescence is a tour, the state is already pruned, or time is up
+
+		gap = upper - bound if upper < np.inf else abs(bound) / n + 1
+		pi = pi + step * gap / norm * gradient
+
+	return best, bestPi
+
+# Chu-Liu/Edmonds minimum spanning arborescence of a dense cost matrix
+# Returns the cost and parent array (parent[root] = -1), or (inf, None) when some
+# node cannot be reached from the root
+# TIME: N^2 per contraction level, at most N levels
+# SPACE: N^2
+def minArborescence( weights, root ):
+	n = len(weights)
+	weights = weights.copy()
+	weights[:, root] = np.inf
+	np.fill_diagonal( weights, np.inf )
+
+	# Cheapest edge into every node
+	parent = np.argmin( weights, axis=0 )
+	inCost = weights[parent, np.arange(n)]
+	parent[root] = -1
+	inCost[root] = 0
+	if np.isinf(inCost).any():
+		return np.inf, None
+
+	# Look for cycles among the cheapest in-edges
+	comp = np.full( n, -1 )
+	mark = np.full( n, -1 )
+	ncomp = 0
+	for start in range(n):
+		v = start
+		while v != root and mark[v] == -1:
+			mark[v] = start
+			v = parent[v]
+		if v != root and mark[v] == start and comp[v] == -1:
+			u = v
+			while True:
+				comp[u] = ncomp
+				u = parent[u]
+				if u == v:
+					break
+			ncomp += 1
+	if ncomp == 0:
+		return inCost.sum(), parent
+
+	# Contract every cycle into one node; entering a cycle at v replaces v's cycle edge
+	inCycle = comp >= 0
+	single = np.flatnonzero( ~inCycle )
+	comp[single] = ncomp + np.arange( len(single) )
+	ncomp += len(single)
+	adjusted = weights - np.where( inCycle, inCost, 0 )[np.newaxis, :]
+	contracted = np.full( (ncomp, ncomp), np.inf )
+	np.minimum.at( contracted, (comp[:, np.newaxis], comp[np.newaxis, :]), adjusted )
+	np.fill_diagonal( contracted, np.inf )
+
+	_, contractedParent = minArborescence( contracted, comp[root] )
+	if contractedParent is None:
+		return np.inf, None
+
+	# Expand: each contracted edge cu -> cv becomes the cheapest real edge u -> v between them,
+	# and v drops its cycle edge
+	order = np.argsort( comp, kind='stable' )
+	members = np.split( order, np.cumsum( np.bincount(comp, minlength=ncomp) )[:-1] )
+	for cv in range(ncomp):
+		cu = contractedParent[cv]
+		if cu < 0:
+			continue
+		us, vs = members[cu], members[cv]
+		best = np.argmin( adjusted[np.ix_(us, vs)] )
+		parent[vs[best % len(vs)]] = us[best // len(vs)]
+
+	nonroot = np.arange(n) != root
+	return weights[parent[nonroot], np.flatnonzero(nonroot)].sum(), parent
+
+
+
+BOUNDS = { bound.name: bound for bound in (ReducedCostBound, AssignmentBound, ArborescenceBound) }
@@ -1,17 +1,37 @@
 #!/usr/bin/python3
 
 
+import heapq
 import math
 import numpy as np
+import pickle
 import random
+import tempfile
 import time
 
+from TSPCosts import CostView, EdgeSet
 
+
+# A branch-and-bound search state.  Instead of its own reduced cost matrix, a state
+# keeps whatever its lower bound needs to expand it later in boundData (for the
+# reduction bound, the accumulated row and column reductions; see TSPBounds).
+# The route is a parent pointer plus the index of the last city, with the visited
+# cities kept as an integer bitmask; the full route is only walked out when needed.
+# A state read back from disk has no parent and keeps the route before it as an array
 class bbState:
-	def __init__(self, path, currDepth, citySquare, cost):
-		self.route = path
-		self.depth = currDepth
-		self.cityMatrix = citySquare
+	__slots__ = ('parent', 'prefix', 'city', 'depth', 'visited', 'boundData', 'lowerBound', 'queueKey')
+
+	def __init__(self, parent, city, boundData, cost):
+		self.parent = parent
+		self.prefix = None
+		self.city = city
+		if parent is None:
+			self.depth = 0
+			self.visited = 1 << city
+		else:
+			self.depth = parent.depth + 1
+			self.visited = parent.visited | (1 << city)
+		self.boundData = boundData
 		self.lowerBound = cost
 
 		self.queueKey = self.lowerBound / ((self.depth + 1) * 5)
@@ -19,20 +39,166 @@ class bbState:
 	def __lt__(self, other):
 		return self.queueKey < other.queueKey
 
+	# A state with the given route, as an array of city indices, and no parent
+	@classmethod
+	def fromRoute(cls, route, visited, boundData, cost):
+		state = cls(None, int(route[-1]), boundData, cost)
+		state.prefix = route[:-1]
+		state.depth = len(route) - 1
+		state.visited = visited
+		state.queueKey = cost / ((state.depth + 1) * 5)
+		return state
+
+	def hasVisited(self, city):
+		return (self.visited >> city) & 1
+
+	# City indices from the start of the route to this state's city
+	def getRoute(self):
+		route = []
+		state = self
+		while state.parent is not None:
+			route.append(state.city)
+			state = state.parent
+		route.append(state.city)
+		route.reverse()
+		if state.prefix is not None:
+			return state.prefix.tolist() + route
+		return route
+
+''' <summary>
+	Priority queue of branch-and-bound states with a selectable search strategy:
+	  'weighted' - the original ordering, lower bound scaled down by depth (bbState.queueKey)
+	  'best'     - best-first, lowest lower bound first (deepest first on ties)
+	  'depth'    - depth-first, expanding the best child of the deepest state first
+	  'hybrid'   - depth-first until the search finds its own first complete tour
+	               (see foundSolution) or has popped DIVE_LIMIT states, then
+	               best-first; with a tight seeded BSSF the dive may never reach
+	               a tour
+	With a max_size, overflowing the queue drops its worst states (highest lower
+	bound) down to trim_fraction of max_size, or with spill=True writes them to
+	temporary files and reads them back, best chunk first, once the queue in
+	memory runs empty.  A spilled state is written as its route array, visited
+	bitmask, bound data and lower bound, without its chain of parents, and read
+	back as a bbState.fromRoute.
+	</summary> '''
+class bbQueue:
+
+	STRATEGIES = ('weighted', 'best', 'depth', 'hybrid')
+	DIVE_LIMIT = 1000 # Most states the hybrid strategy pops depth-first without finding a tour
+
+	def __init__(self, strategy='weighted', max_size=None, spill=False, trim_fraction=0.75):
+		if strategy not in self.STRATEGIES:
+			raise ValueError('Unsupported search strategy: {}'.format(strategy))
+		self._strategy = strategy
+		self._diving = strategy in ('depth', 'hybrid')
+		self._dived = 0 # states popped so far in the hybrid dive
+		self._heap = []
+		self._max_size = max_size
+		self._spill = spill
+		self._trim_fraction = trim_fraction
+		self._chunks = [] # spilled states: (lowest lower bound, number of states, file)
+		self.dropped = 0
+		self.spilled = 0
+
+	def __len__(self):
+		return len(self._heap) + sum(chunk[1] for chunk in self._chunks)
+
+	# Number of states held in memory
+	def inMemory(self):
+		return len(self._heap)
+
+	def _setKey(self, state):
+		if self._strategy == 'weighted':
+			return # bbState computes this ordering itself
+		if self._diving:
+			state.queueKey = (-state.depth, state.lowerBound)
+		else:
+			state.queueKey = (state.lowerBound, -state.depth)
+
+	def push(self, state):
+		self._setKey(state)
+		heapq.heappush(self._heap, state)
+		if self._max_size is not None and len(self._heap) > self._max_size:
+			self._overflow()
+
+	def pop(self):
+		if not self._heap:
+			self._reload()
+		if self._strategy == 'hybrid' and self._diving:
+			self._dived += 1
+			if self._dived > self.DIVE_LIMIT:
+				self._endDive()
+		return heapq.heappop(self._heap)
+
+	# Called when the search reaches a complete tour; ends the hybrid strategy's dive
+	def foundSolution(self):
+		if self._strategy == 'hybrid' and self._diving:
+			self._endDive()
+
+	# Switches the hybrid strategy from depth-first to best-first
+	# TIME: Q
+	def _endDive(self):
+		self._diving = False
+		for state in self._heap:
+			self._setKey(state)
+		heapq.heapify(self._heap)
+
+	# Removes and returns the count shallowest states (the biggest subtrees),
+	# for handing work to another branch-and-bound worker
+	# TIME: Q Log Q
+	def steal(self, count):
+		self._heap.sort(key=lambda state: (state.depth, state.lowerBound))
+		taken = self._heap[:count]
+		del self._heap[:count]
+		heapq.heapify(self._heap)
+		return taken
+
+	# Moves the states with the highest lower bounds out of memory
+	# TIME: Q Log Q
+	def _overflow(self):
+		keep = max(int(self._trim_fraction * self._max_size), 1)
+		self._heap.sort(key=lambda state: state.lowerBound)
+		worst = self._heap[keep:]
+		del self._heap[keep:]
+		heapq.heapify(self._heap)
+
+		if self._spill:
+			records = [ (np.array(state.getRoute(), dtype=np.int32), state.visited, state.boundData, state.lowerBound) \
+						for state in worst ]
+			spillFile = tempfile.TemporaryFile()
+			pickle.dump(records, spillFile, protocol=pickle.HIGHEST_PROTOCOL)
+			self._chunks.append( (worst[0].lowerBound, len(worst), spillFile) )
+			self.spilled += len(worst)
+		else:
+			self.dropped += len(worst)
+
+	# Reads back the spilled chunk with the lowest lower bound
+	def _reload(self):
+		if not self._chunks:
+			return
+		self._chunks.sort(key=lambda chunk: chunk[0])
+		_, _, spillFile = self._chunks.pop(0)
+		spillFile.seek(0)
+		states = [ bbState.fromRoute(*record) for record in pickle.load(spillFile) ]
+		spillFile.close()
+		for state in states:
+			self._setKey(state)
+		self._heap.extend(states)
+		heapq.heapify(self._heap)
+
+
+
 class TSPSolution:
 	def __init__( self, listOfCities):
 		self.route = listOfCities
+		self.indices = [ city._index for city in listOfCities ] # The route as city indices
 		self.cost = self._costOfRoute()
-		#print( [c._index for c in listOfCities] )
 
 	def _costOfRoute( self ):
-		cost = 0
-		last = self.route[0]
-		for city in self.route[1:]:
-			cost += last.costTo(city)
-			last = city
-		cost += self.route[-1].costTo( self.route[0] )
-		return cost
+		costs = self.route[0]._scenario.getCosts()
+		path = np.array( self.indices, dtype=np.intp )
+		cost = costs[path, np.roll(path, -1)].sum()
+		return int(cost) if cost < np.inf else np.inf
 
 	def enumerateEdges( self ):
 		elist = []
@@ -50,6 +216,27 @@ class TSPSolution:
 		return elist
 
 
+DATA_RANGE = { 'x':[-1.5,1.5], 'y':[-1.0,1.0] } # Area the GUI places cities in
+
+''' <summary>
+	Random city coordinates, uniform over data_range, drawn from the random
+	module seeded with rand_seed exactly as the GUI draws them, so a size and
+	seed give the GUI's cities.  Leaves the random module where Normal and Hard
+	modes expect it to draw their elevations.
+	</summary>
+	<returns>(xs, ys) as float64 arrays</returns> '''
+def newPoints( npoints, rand_seed, data_range=DATA_RANGE ):
+	random.seed( rand_seed )
+	xr, yr = data_range['x'], data_range['y']
+	xs, ys = np.empty( npoints ), np.empty( npoints )
+	for i in range(npoints):
+		x = random.uniform(0.0,1.0)
+		y = random.uniform(0.0,1.0)
+		xs[i] = xr[0] + (xr[1]-xr[0])*x
+		ys[i] = yr[0] + (yr[1]-yr[0])*y
+	return xs, ys
+
+
 def nameForInt( num ):
 	if num == 0:
 		return ''
@@ -65,24 +252,74 @@ def nameForInt( num ):
 
 
 
+''' <summary>
+	The cities of one problem instance and the edges between them.
+
+	In Hard (Deterministic) mode the instance depends only on rand_seed and
+	seed_version.  Version 1 is the original generator, which draws elevations
+	and removed edges one at a time from the random module; it is slow for
+	thousands of cities but still reproduces instances from old seeds.  Version 2
+	(the default) draws everything from its own NumPy Generator seeded with
+	rand_seed, a batch at a time (see thinEdges), and leaves the random module's
+	state alone.  The same seed gives different instances under the two versions.
+
+	Edges are held in a TSPCosts.EdgeSet, a bitset of the removed edges in Hard
+	modes and nothing at all otherwise.  The full cost matrix is built the first
+	time getCostMatrix asks for it; getCosts gives the matrix for up to
+	DENSE_COST_CITIES cities and a TSPCosts.CostView, which computes costs from
+	the coordinates as they are asked for, past that.
+	</summary> '''
 class Scenario:
 
 	HARD_MODE_FRACTION_TO_REMOVE = 0.20 # Remove 20% of the edges
+	SEED_VERSION = 2 # Default way Hard (Deterministic) turns rand_seed into an instance
+	DENSE_COST_CITIES = 2500 # Most cities for which getCosts builds the full cost matrix (50 MB)
+
+	DIFFICULTIES = ('Easy', 'Normal', 'Hard', 'Hard (Deterministic)')
 
-	def __init__( self, city_locations, difficulty, rand_seed ):
+	# city_locations are points with x() and y() methods, such as QPointF
+	def __init__( self, city_locations, difficulty, rand_seed, seed_version=SEED_VERSION ):
+		xs = np.array( [pt.x() for pt in city_locations], dtype=np.float64 )
+		ys = np.array( [pt.y() for pt in city_locations], dtype=np.float64 )
+		self._build( xs, ys, difficulty, rand_seed, seed_version )
+
+	''' <summary>
+		Builds a scenario straight from arrays of city coordinates, with no point
+		objects and so no Qt.  The instance is the one the same coordinates give as
+		points, so newPoints' arrays reproduce the GUI's instance for a size and
+		seed.  Given elevations replace the random ones once those are drawn, which
+		leaves the removed edges as they would otherwise be; Easy mode has no
+		elevations and ignores them.
+		</summary> '''
+	@classmethod
+	def fromCoordinates( cls, xs, ys, difficulty, rand_seed=None, elevations=None, seed_version=SEED_VERSION ):
+		scenario = cls.__new__( cls )
+		scenario._build( np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64), \
+						 difficulty, rand_seed, seed_version, elevations )
+		return scenario
+
+	def _build( self, xs, ys, difficulty, rand_seed, seed_version, elevations=None ):
+		if difficulty not in self.DIFFICULTIES:
+			raise ValueError('Unsupported difficulty: {}'.format(difficulty))
+		if seed_version not in (1, 2):
+			raise ValueError('Unsupported seed version: {}'.format(seed_version))
 		self._difficulty = difficulty
+		self._seed_version = seed_version
+		self._rng = None
 
 		if difficulty == "Normal" or difficulty == "Hard":
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
-		elif difficulty == "Hard (Deterministic)":
+			drawn = [random.uniform(0.0,1.0) for _ in range(len(xs))]
+		elif difficulty == "Hard (Deterministic)" and seed_version == 1:
 			random.seed( rand_seed )
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
+			drawn = [random.uniform(0.0,1.0) for _ in range(len(xs))]
+		elif difficulty == "Hard (Deterministic)":
+			self._rng = np.random.default_rng( rand_seed )
+			drawn = self._rng.random( len(xs) ).tolist()
 		else:
-			self._cities = [City( pt.x(), pt.y() ) for pt in city_locations]
+			drawn = [0.0] * len(xs)
+		if elevations is not None and difficulty != "Easy":
+			drawn = np.asarray( elevations, dtype=np.float64 ).tolist()
+		self._cities = [City( x, y, elevation ) for x, y, elevation in zip(xs.tolist(), ys.tolist(), drawn)]
 
 
 		num = 0
@@ -94,17 +331,135 @@ class Scenario:
 
 		# Assume all edges exists except self-edges
 		ncities = len(self._cities)
-		self._edge_exists = ( np.ones((ncities,ncities)) - np.diag( np.ones((ncities)) ) ) > 0
+		self._edges = EdgeSet( ncities )
 
 		if difficulty == "Hard":
 			self.thinEdges()
 		elif difficulty == "Hard (Deterministic)":
 			self.thinEdges(deterministic=True)
 
+		xs, ys = self.getCoordinates()
+		elevations = None if difficulty == 'Easy' else \
+					 np.array( [city._elevation for city in self._cities], dtype=np.float64 )
+		self._cost_view = CostView( xs, ys, elevations, self._edges, City.MAP_SCALE )
+		self._cost_matrix = None
+		self._neighbor_lists = {}
+
 	def getCities( self ):
 		return self._cities
 
+	# The full cost matrix, built on first use
+	# SPACE: N^2
+	def getCostMatrix( self ):
+		if self._cost_matrix is None:
+			self._cost_matrix = self.buildCostMatrix()
+		return self._cost_matrix
+
+	# Costs indexed like the cost matrix: the matrix itself for up to
+	# DENSE_COST_CITIES cities (or once it has been built), a CostView past that
+	def getCosts( self ):
+		if self._cost_matrix is not None or len(self._cities) <= self.DENSE_COST_CITIES:
+			return self.getCostMatrix()
+		return self._cost_view
+
+	def getCoordinates( self ):
+		xs = np.array( [city._x for city in self._cities], dtype=np.float64 )
+		ys = np.array( [city._y for city in self._cities], dtype=np.float64 )
+		return xs, ys
 
+	''' <summary>
+		Computes the cost of every (source,destination) pair at once, using the
+		same rules as City.costTo: Euclidean distance plus the elevation change
+		(clamped at zero) outside of Easy mode, scaled by MAP_SCALE and rounded up.
+		Missing edges (including self-edges) are infinity.  The finite entries
+		are whole numbers stored as float64 so the matrix can hold np.inf.
+		</summary> '''
+	def buildCostMatrix( self ):
+		xs, ys = self.getCoordinates()
+
+		# Row is the source city, column is the destination city
+		cost = np.sqrt( (xs[np.newaxis,:] - xs[:,np.newaxis])**2 +
+						(ys[np.newaxis,:] - ys[:,np.newaxis])**2 )
+
+		if not self._difficulty == 'Easy':
+			elev = np.array( [city._elevation for city in self._cities], dtype=np.float64 )
+			cost += elev[np.newaxis,:] - elev[:,np.newaxis]
+			np.maximum( cost, 0.0, out=cost )
+
+		cost = np.ceil( cost * City.MAP_SCALE )
+		cost[~self._edges.dense()] = np.inf
+		return cost
+
+
+	''' <summary>
+		Candidate lists for local search: for every city, up to k destinations
+		reachable from it, cheapest first.  Candidates are gathered from a uniform
+		grid over the city coordinates (about two cities per cell, widening one
+		ring of cells at a time) and then ranked by the real, asymmetric cost, so
+		edges removed by thinEdges never appear.  Lists are cached per k.
+		</summary>
+		<returns>list of int arrays, one per city index; a list is shorter than k
+		only when too few of the nearby edges exist</returns> '''
+	NEIGHBOR_OVERSAMPLE = 2 # gather this many times k nearby cities before ranking by cost
+
+	def neighborLists( self, k ):
+		if k in self._neighbor_lists:
+			return self._neighbor_lists[k]
+
+		ncities = len(self._cities)
+		costs = self.getCosts()
+		xs, ys = self.getCoordinates()
+		want = min( self.NEIGHBOR_OVERSAMPLE*k, ncities-1 )
+
+		# Bucket the cities into square cells, about two cities per cell
+		width, height = np.ptp(xs), np.ptp(ys)
+		side = math.sqrt( 2.0 * max(width*height, (max(width,height)**2)/ncities) / ncities )
+		if side == 0.0:
+			side = 1.0
+		gx = ((xs - xs.min()) / side).astype(np.int64)
+		gy = ((ys - ys.min()) / side).astype(np.int64)
+		ncx, ncy = int(gx.max())+1, int(gy.max())+1
+		keys = gx*ncy + gy
+		order = np.argsort( keys, kind='stable' )
+		cell_keys, starts = np.unique( keys[order], return_index=True )
+		ends = np.append( starts[1:], ncities )
+		cells = { int(key): order[start:end] for key, start, end in zip(cell_keys, starts, ends) }
+
+		neighbors = []
+		for city in range( ncities ):
+			cx, cy = int(gx[city]), int(gy[city])
+			found = []
+			count = 0
+			ring = 0
+			enough_at = None
+			# Widen the search one ring at a time, then take one extra ring so cities
+			# just across a cell border are not missed
+			while enough_at is None or ring <= enough_at + 1:
+				if ring > max(ncx, ncy):
+					break
+				for x in range( max(cx-ring, 0), min(cx+ring, ncx-1)+1 ):
+					for y in range( max(cy-ring, 0), min(cy+ring, ncy-1)+1 ):
+						if max( abs(x-cx), abs(y-cy) ) != ring:
+							continue
+						cell = cells.get( x*ncy + y )
+						if cell is not None:
+							found.append( cell )
+							count += len(cell)
+				if enough_at is None and count > want:
+					enough_at = ring
+				ring += 1
+
+			candidates = np.concatenate( found )
+			candidates = candidates[candidates != city]
+			cand_costs = costs[city, candidates]
+			reachable = cand_costs < np.inf
+			candidates, cand_costs = candidates[reachable], cand_costs[reachable]
+			neighbors.append( candidates[np.argsort( cand_costs, kind='stable' )[:k]] )
+
+		self._neighbor_lists[k] = neighbors
+		return neighbors
+
+	# Fisher-Yates on the random module, kept so seed version 1 instances come out the same
 	def randperm( self, n ):				#isn't there a numpy function that does this and even gets called in Solver?
 		perm = np.arange(n)
 		for i in range(n):
@@ -114,30 +469,67 @@ class Scenario:
 			perm[randind] = save
 		return perm
 
+	''' <summary>
+		Removes HARD_MODE_FRACTION_TO_REMOVE of the edges at random, except for
+		those of one random tour, which are kept so at least one tour exists.
+		Edges are drawn in batches of random flat indices into the edge matrix, as
+		many as there are edges still to remove, and every edge drawn that can go
+		is removed; a batch is checked and removed THIN_CHUNK draws at a time.
+		Each chunk of draws is sorted and its repeats dropped, so no edge is
+		counted as removed twice.  Draws that repeat or hit an edge that is
+		already gone or must stay only make a batch remove fewer, so the count comes out exact after a few
+		batches, and since no edge is favored the removed edges are a uniform
+		random choice, as if drawn one at a time.  Each batch is O(edges to
+		remove log THIN_CHUNK) with no n x n matrix and no list of every
+		deletable edge.
+		Deterministic mode draws from the seeded Generator, otherwise from
+		np.random; seed version 1 uses _legacyThinEdges.
+		</summary> '''
+	THIN_CHUNK = 1 << 20 # Draws checked and removed at once, bounding thinEdges' working memory
+
 	def thinEdges( self, deterministic=False ):
 		ncities = len(self._cities)
 		edge_count = ncities*(ncities-1) # can't have self-edge
-		num_to_remove = np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count)
+		num_to_remove = int(np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count))
+		if deterministic and self._seed_version == 1:
+			self._legacyThinEdges( num_to_remove )
+			return
+		rng = self._rng if deterministic else np.random
+
+		# Set aside a route to ensure at least one tour exists
+		route_keep = rng.permutation( ncities )
+		keep_next = np.empty( ncities, dtype=np.intp )
+		keep_next[route_keep] = np.roll( route_keep, -1 )
 
-		can_delete	= self._edge_exists.copy()
+		edge_slots = ncities * ncities
+		while num_to_remove > 0:
+			removed = 0
+			for start in range( 0, num_to_remove, self.THIN_CHUNK ):
+				draws = (rng.random( min(self.THIN_CHUNK, num_to_remove - start) ) * edge_slots).astype(np.int64)
+				draws.sort()
+				draws = draws[np.append( True, draws[1:] != draws[:-1] )]
+				src, dst = np.divmod( draws, ncities )
+				drop = self._edges.exists( src, dst ) & (keep_next[src] != dst)
+				self._edges.remove( src[drop], dst[drop] )
+				removed += np.count_nonzero( drop )
+			num_to_remove -= removed
+
+	# The original thinEdges, one edge per draw from the random module (seed version 1)
+	def _legacyThinEdges( self, num_to_remove ):
+		ncities = len(self._cities)
 
 		# Set aside a route to ensure at least one tour exists
-		route_keep = np.random.permutation( ncities )
-		if deterministic:
-			route_keep = self.randperm( ncities )
+		route_keep = self.randperm( ncities )
+		keep_next = [0] * ncities
 		for i in range(ncities):
-			can_delete[route_keep[i],route_keep[(i+1)%ncities]] = False
+			keep_next[route_keep[i]] = route_keep[(i+1)%ncities]
 
 		# Now remove edges until 
 		while num_to_remove > 0:
-			if deterministic:
-				src = random.randint(0,ncities-1)
-				dst = random.randint(0,ncities-1)
-			else:
-				src = np.random.randint(ncities)
-				dst = np.random.randint(ncities)
-			if self._edge_exists[src,dst] and can_delete[src,dst]:
-				self._edge_exists[src,dst] = False
+			src = random.randint(0,ncities-1)
+			dst = random.randint(0,ncities-1)
+			if self._edges.exists(src,dst) and keep_next[src] != dst:
+				self._edges.remove(src,dst)
 				num_to_remove -= 1
 
 
@@ -173,24 +565,10 @@ class City:
 		</summary> '''
 	MAP_SCALE = 1000.0
 	def costTo( self, other_city ):
-
-		assert( type(other_city) == City )
-
-		# In hard mode, remove edges; this slows down the calculation...
-		# Use this in all difficulties, it ensures INF for self-edge
-		if not self._scenario._edge_exists[self._index, other_city._index]:
+		# Costs come from Scenario.getCosts; missing edges (including the
+		# self-edge) are infinity
+		cost = self._scenario.getCosts()[self._index, other_city._index]
+		if cost == np.inf:
 			return np.inf
-
-		# Euclidean Distance
-		cost = math.sqrt( (other_city._x - self._x)**2 +
-						  (other_city._y - self._y)**2 )
-
-		# For Medium and Hard modes, add in an asymmetric cost (in easy mode it is zero).
-		if not self._scenario._difficulty == 'Easy':
-			cost += (other_city._elevation - self._elevation)
-			if cost < 0.0:
-				cost = 0.0					# Shouldn't it cost something to go downhill, no matter how steep??????
-
-
-		return int(math.ceil(cost * self.MAP_SCALE))
+		return int(cost)
 
@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+
+
+import numpy as np
+
+from TSPCosts import withMissing
+
+
+
+
+''' <summary>
+	Fast tour construction heuristics.  Each one takes the scenario's costs, the
+	cost matrix or a TSPCosts.CostView (hilbertTour also takes the city
+	coordinates), and returns a tour as a list of city indices.
+
+	Costs are asymmetric and Hard mode removes edges, so a tour built by any of
+	these rules can still use a missing edge.  Missing edges are treated as very
+	expensive while building, and repairTour then moves cities off any that are
+	left.  The result can still have an infinite cost when no such move
+	exists, which the caller has to check.
+	</summary> '''
+
+# Stand-in for a missing edge, as in LocalSearch; large enough that a tour with
+# fewer missing edges is always cheaper, yet exact in float64 arithmetic
+MISSING_EDGE = 2.0**40
+
+HILBERT_ORDER = 16 # Bits per axis of the grid cities are snapped to for the Hilbert curve
+START_BLOCK = 1 << 22 # Most round trips insertionTour compares at once when picking its start
+REPAIR_SEGMENT = 3 # Longest stretch of cities repairTour moves at once
+
+
+
+
+# The costs with missing edges (and the diagonal) replaced by MISSING_EDGE
+def _finiteCosts( costs ):
+	return withMissing( costs, MISSING_EDGE, np.float64 )
+
+''' <summary>
+	Moves cities off missing edges.  For each missing edge in the tour, tries
+	every move that removes it: taking a stretch of one to REPAIR_SEGMENT cities
+	on either side of it out of the tour and putting it back, either way round,
+	between another pair of neighboring cities (Or-opt), or reversing a path that
+	starts or ends at the edge (2-opt).  The move that leaves the cheapest tour,
+	with missing edges at MISSING_EDGE, is made if it is cheaper than the tour
+	was, so every move removes a missing edge or trades it for a cheaper set of
+	edges.  Moving the single city on either side is tried on its own first,
+	since that is all most missing edges need.  Stops when no missing edge has
+	such a move.
+	</summary>
+	<returns>the repaired tour as a list of city indices</returns> '''
+# TIME: N per missing edge per move
+def repairTour( costs, route ):
+	ncities = len(route)
+	if ncities < 3:
+		return list(route)
+	C = _finiteCosts( costs )
+	tour = np.array( route, dtype=np.intp )
+
+	while True:
+		missing = np.flatnonzero( np.isinf(costs[tour, np.roll(tour, -1)]) )
+		for k in missing:
+			# Turned so that the missing edge is the one closing the tour, last -> first
+			turned = np.roll( tour, -(k + 1) )
+			repaired = _bestRepair( C, turned, False )
+			if repaired is None:
+				repaired = _bestRepair( C, turned, True )
+			if repaired is not None:
+				tour = repaired
+				break
+		else:
+			return tour.tolist()
+
+# The cheapest tour one of repairTour's moves makes from a tour whose closing
+# edge tour[-1] -> tour[0] is to go, or None if none is cheaper than the tour
+# With thorough=False only the single city on either side of the edge is moved
+# TIME: N, times REPAIR_SEGMENT when thorough
+def _bestRepair( C, tour, thorough ):
+	n = len(tour)
+	best, bestMove = 0.0, None
+	closing = C[tour[-1], tour[0]]
+	if thorough:
+		ahead = np.concatenate( ([0.0], np.cumsum( C[tour[:-1], tour[1:]] )) )
+		back = np.concatenate( ([0.0], np.cumsum( C[tour[1:], tour[:-1]] )) )
+
+	# Or-opt: the stretch tour[:length] or tour[-length:] goes between rest[i] and rest[i+1]
+	for length in (range( 1, min(REPAIR_SEGMENT, n - 2) + 1 ) if thorough else (1,)):
+		for atStart in (True, False):
+			if atStart:
+				segment, rest = tour[:length], tour[length:]
+				saved = closing + C[segment[-1], rest[0]] - C[rest[-1], rest[0]]
+			else:
+				segment, rest = tour[n - length:], tour[:n - length]
+				saved = C[rest[-1], segment[0]] + closing - C[rest[-1], rest[0]]
+			following = np.roll( rest, -1 )
+			for reverse in ((False, True) if thorough else (False,)):
+				first, last = (segment[-1], segment[0]) if reverse else (segment[0], segment[-1])
+				added = C[rest, first] + C[last, following] - C[rest, following]
+				if reverse:
+					# The stretch's own edges are walked the other way
+					start = 0 if atStart else n - length
+					added = added + (back[start + length - 1] - back[start]) \
+								  - (ahead[start + length - 1] - ahead[start])
+				at = np.argmin( added )
+				if added[at] - saved < best:
+					best, bestMove = added[at] - saved, (rest, at, segment[::-1] if reverse else segment)
+	if not thorough:
+		return None if bestMove is None else _applyRepair( tour, bestMove )
+
+	# 2-opt: reverse tour[:j+1], or tour[j:]
+	js = np.arange( 1, n - 1 )
+	changes = ( C[tour[-1], tour[js]] + C[tour[0], tour[js + 1]] - closing - C[tour[js], tour[js + 1]] \
+				+ back[js] - ahead[js], \
+				C[tour[js - 1], tour[-1]] + C[tour[js], tour[0]] - C[tour[js - 1], tour[js]] - closing \
+				+ (back[n - 1] - back[js]) - (ahead[n - 1] - ahead[js]) )
+	for prefix, change in zip((True, False), changes):
+		at = np.argmin( change )
+		if change[at] < best:
+			best, bestMove = change[at], (int(js[at]), prefix)
+
+	return None if bestMove is None else _applyRepair( tour, bestMove )
+
+# The tour after a move found by _bestRepair
+def _applyRepair( tour, move ):
+	if len(move) == 3:
+		rest, at, segment = move
+		return np.concatenate( (rest[:at + 1], segment, rest[at + 1:]) )
+	j, prefix = move
+	if prefix:
+		return np.concatenate( (tour[j::-1], tour[j + 1:]) )
+	return np.concatenate( (tour[:j], tour[:j - 1:-1]) )
+
+''' <summary>
+	Greedy-edge (shortest edge first) construction.  Edges from each city to its
+	candidate neighbors are taken cheapest first whenever the tail has no
+	successor yet, the head has no predecessor yet, and a union-find shows the
+	two are in different path fragments, so no subtour can close early.  The
+	fragments left over are then chained together, each fragment's last city
+	going to the cheapest remaining fragment's first city.
+	</summary>
+	<returns>the tour as a list of city indices</returns> '''
+# TIME: N K log(N K) to sort the candidate edges, plus F^2 to chain F fragments
+def greedyEdgeTour( costs, nearest ):
+	ncities = len(costs)
+	succ = [-1] * ncities
+	pred = [-1] * ncities
+	parent = list(range(ncities))
+
+	tails = np.repeat( np.arange(ncities), nearest.shape[1] )
+	_joinCheapest( costs, tails, nearest.reshape(-1), succ, pred, parent )
+
+	# Chain the fragments, starting from the one with the lowest-index first city
+	C = _finiteCosts( costs )
+	firsts = np.array( [city for city in range(ncities) if pred[city] < 0], dtype=np.intp )
+	waiting = np.ones( len(firsts), dtype=bool )
+	route = []
+	nxt = 0
+	for _ in range(len(firsts)):
+		waiting[nxt] = False
+		city = int(firsts[nxt])
+		while city >= 0:
+			route.append( city )
+			city = succ[city]
+		if waiting.any():
+			options = np.where( waiting, C[route[-1], firsts], np.inf )
+			nxt = np.argmin( options )
+	return repairTour( costs, route )
+
+# Links edges tail -> head, cheapest first (ties by tail then head), skipping
+# missing edges and any edge that would give a city two successors or two
+# predecessors or close a cycle, until a single path covers every city
+def _joinCheapest( costs, tails, heads, succ, pred, parent ):
+	weights = costs[tails, heads]
+	usable = np.isfinite(weights) & (tails != heads)
+	tails, heads, weights = tails[usable], heads[usable], weights[usable]
+	order = np.lexsort( (heads, tails, weights) )
+
+	def find( city ):
+		while parent[city] != city:
+			parent[city] = parent[parent[city]]
+			city = parent[city]
+		return city
+
+	joined = 0
+	for a, b in zip(tails[order].tolist(), heads[order].tolist()):
+		if joined == len(succ) - 1:
+			break
+		if succ[a] >= 0 or pred[b] >= 0:
+			continue
+		root_a, root_b = find(a), find(b)
+		if root_a == root_b:
+			continue
+		parent[root_a] = root_b
+		succ[a], pred[b] = b, a
+		joined += 1
+
+''' <summary>
+	Insertion construction, starting from the two-city tour with the cheapest
+	(rule='cheapest') or most expensive (rule='farthest') round trip.  Cheapest
+	insertion then adds whichever city is cheapest to insert; farthest insertion
+	adds the city whose cheapest edge to or from the tour is the most expensive.
+	Either way the city goes between the pair of tour neighbors where it adds the
+	least cost.  Each city's best insertion point is kept up to date as the tour
+	grows, and only rescanned when the edge it pointed at is replaced.
+	</summary>
+	<returns>the tour as a list of city indices</returns> '''
+# TIME: N^2
+# SPACE: N^2 for the finite copy of a cost matrix, N for a CostView
+def insertionTour( costs, rule='cheapest' ):
+	ncities = len(costs)
+	if ncities < 3:
+		return list(range(ncities))
+	C = _finiteCosts( costs )
+	s, t = _startPair( C, rule )
+
+	succ = np.full( ncities, -1, dtype=np.intp )
+	succ[s], succ[t] = t, s
+	inserted = np.zeros( ncities, dtype=bool )
+	inserted[[s, t]] = True
+
+	# Cheapest place to insert each city, as the tail of the tour edge it goes into
+	bestTail = np.full( ncities, s, dtype=np.intp )
+	bestCost = C[s, :] + C[:, t] - C[s, t]
+	viaT = C[t, :] + C[:, s] - C[t, s]
+	bestTail[viaT < bestCost] = t
+	bestCost = np.minimum( bestCost, viaT )
+	bestCost[inserted] = np.inf
+	# Cheapest edge between each city and the tour, for farthest insertion
+	reach = np.minimum( np.minimum(C[s, :], C[:, s]), np.minimum(C[t, :], C[:, t]) )
+	reach[inserted] = -np.inf
+
+	for _ in range(ncities - 2):
+		city = np.argmax( reach ) if rule == 'farthest' else np.argmin( bestCost )
+		a = bestTail[city]
+		b = succ[a]
+		succ[a], succ[city] = city, b
+		inserted[city] = True
+		bestCost[city], reach[city] = np.inf, -np.inf
+
+		# Cities that were going into the edge a -> b need a full rescan
+		stale = np.flatnonzero( (bestTail == a) & ~inserted )
+		if len(stale):
+			tails = np.flatnonzero( inserted )
+			heads = succ[tails]
+			added = C[np.ix_(tails, stale)].T + C[np.ix_(stale, heads)] - C[tails, heads]
+			best = np.argmin( added, axis=1 )
+			bestTail[stale] = tails[best]
+			bestCost[stale] = added[np.arange(len(stale)), best]
+
+		# Everyone else only needs to look at the two new edges
+		for tail, head in ((a, city), (city, b)):
+			viaNew = C[tail, :] + C[:, head] - C[tail, head]
+			better = (viaNew < bestCost) & ~inserted
+			bestTail[better] = tail
+			bestCost[better] = viaNew[better]
+
+		if rule == 'farthest':
+			reach = np.where( inserted, -np.inf, np.minimum(reach, np.minimum(C[city, :], C[:, city])) )
+
+	route = [s]
+	while succ[route[-1]] != s:
+		route.append( int(succ[route[-1]]) )
+	return repairTour( costs, route )
+
+# The two cities whose round trip insertion starts from: the cheapest, or for
+# rule='farthest' the most expensive without a missing edge, ties going to the
+# first in row order; START_BLOCK round trips are compared at a time
+def _startPair( C, rule ):
+	ncities = len(C)
+	rows = max( 1, START_BLOCK // ncities )
+	best, pair = None, None
+	for first in range(0, ncities, rows):
+		block = np.arange( first, min(first + rows, ncities) )
+		roundTrip = C[block] + C[:, block].T
+		roundTrip[np.arange(len(block)), block] = np.inf
+		if rule == 'farthest':
+			roundTrip = np.where( roundTrip < MISSING_EDGE, roundTrip, -np.inf )
+			at = np.argmax( roundTrip )
+			better = best is None or roundTrip.flat[at] > best
+		else:
+			at = np.argmin( roundTrip )
+			better = best is None or roundTrip.flat[at] < best
+		if better:
+			best = roundTrip.flat[at]
+			row, col = divmod( int(at), ncities )
+			pair = (first + row, col)
+	return pair
+
+''' <summary>
+	Space-filling-curve construction: visits the cities in the order they fall
+	along a Hilbert curve through the bounding square of their coordinates, so
+	cities close together on the map tend to be close together in the tour.
+	Costs are not looked at until missing edges are repaired.
+	</summary>
+	<returns>the tour as a list of city indices</returns> '''
+# TIME: N log N (the sort), plus the repair
+def hilbertTour( costs, xs, ys ):
+	side = 2**HILBERT_ORDER
+	span = max( np.ptp(xs), np.ptp(ys) )
+	scale = (side - 1) / span if span > 0 else 0.0
+	x = ((xs - xs.min()) * scale).astype(np.int64)
+	y = ((ys - ys.min()) * scale).astype(np.int64)
+
+	# Distance along the curve of each grid point, a level at a time
+	d = np.zeros( len(xs), dtype=np.int64 )
+	s = side // 2
+	while s > 0:
+		rx = (x & s) > 0
+		ry = (y & s) > 0
+		d += s * s * ((3 * rx) ^ ry)
+		# Rotate the quadrant so the curve below this level is in standard position
+		flip = ~ry & rx
+		x = np.where( flip, side - 1 - x, x )
+		y = np.where( flip, side - 1 - y, y )
+		x, y = np.where( ~ry, y, x ), np.where( ~ry, x, y )
+		s //= 2
+
+	return repairTour( costs, np.argsort(d, kind='stable').tolist() )
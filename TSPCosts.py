@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+
+import math
+import numpy as np
+
+
+
+
+''' <summary>
+	Edge sets and travel costs that do not need an n x n matrix.
+
+	EdgeSet holds which directed edges exist.  Every edge but the self-edges
+	exists until one is removed; removed edges are kept as a bitset with a row of
+	bits per source city, n^2 / 8 bytes, which is only allocated by the first
+	removal.  Easy and Normal instances never allocate it.
+
+	CostView computes costs on demand from the city coordinates and elevations,
+	with the same arithmetic as Scenario.buildCostMatrix, so every cost comes out
+	bit for bit the same as the matrix entry.  It is indexed like the matrix:
+	C[a, b] with integers or broadcastable integer arrays, and C[a] (or a slice
+	in either place) for whole rows or columns.  Lookups of single edges, which local search makes one at a time, take
+	a plain Python path.
+	</summary> '''
+
+
+
+
+class EdgeSet:
+
+	def __init__( self, ncities ):
+		self._n = ncities
+		self._rowBytes = (ncities + 7) // 8
+		self._removed = None
+
+	def __len__( self ):
+		return self._n
+
+	# Memory taken by the removed-edge bitset
+	@property
+	def nbytes( self ):
+		return 0 if self._removed is None else self._removed.nbytes
+
+	# Whether each edge src -> dst exists; integers give a bool, arrays a bool array
+	# TIME: O(1) per edge
+	def exists( self, src, dst ):
+		if isinstance(src, (int, np.integer)) and isinstance(dst, (int, np.integer)):
+			if src == dst:
+				return False
+			if self._removed is None:
+				return True
+			return not (self._removed[src*self._rowBytes + (dst >> 3)] >> (7 - (dst & 7))) & 1
+
+		src, dst = np.broadcast_arrays( np.asarray(src, dtype=np.intp), np.asarray(dst, dtype=np.intp) )
+		found = src != dst
+		if self._removed is not None:
+			found &= (self._removed[src*self._rowBytes + (dst >> 3)] >> (7 - (dst & 7))) & 1 == 0
+		return found
+
+	# Removes the edges src -> dst; integers or arrays, repeats allowed
+	def remove( self, src, dst ):
+		if self._removed is None:
+			self._removed = np.zeros( self._n * self._rowBytes, dtype=np.uint8 )
+		src, dst = np.broadcast_arrays( np.asarray(src, dtype=np.intp), np.asarray(dst, dtype=np.intp) )
+		bits = np.right_shift( 0x80, dst & 7 ).astype(np.uint8)
+		np.bitwise_or.at( self._removed, src*self._rowBytes + (dst >> 3), bits )
+
+	# The edge set as an n x n boolean matrix
+	# SPACE: N^2
+	def dense( self ):
+		found = np.ones( (self._n, self._n), dtype=bool )
+		np.fill_diagonal( found, False )
+		if self._removed is not None:
+			removed = np.unpackbits( self._removed.reshape(self._n, self._rowBytes), axis=1, count=self._n )
+			found &= removed == 0
+		return found
+
+
+
+class CostView:
+
+	def __init__( self, xs, ys, elevations, edges, scale, missing=np.inf, dtype=np.float64 ):
+		self._xs, self._ys = xs, ys
+		self._elevations = elevations
+		self._edges = edges
+		self._scale = scale
+		self._missing = missing
+		self.dtype = np.dtype(dtype)
+		self.shape = (len(xs), len(xs))
+		# Plain floats for the single lookups
+		self._xl, self._yl = xs.tolist(), ys.tolist()
+		self._el = None if elevations is None else elevations.tolist()
+
+	def __len__( self ):
+		return self.shape[0]
+
+	# Whether every cost equals the cost of the reverse edge: no elevations and no edge removed
+	@property
+	def symmetric( self ):
+		return self._elevations is None and self._edges.nbytes == 0
+
+	# The same costs with missing edges as the given value instead of infinity
+	def filled( self, missing, dtype=np.int64 ):
+		return CostView( self._xs, self._ys, self._elevations, self._edges, self._scale, missing, dtype )
+
+	def __getitem__( self, key ):
+		src, dst = key if isinstance(key, tuple) else (key, slice(None))
+		if isinstance(src, (int, np.integer)) and isinstance(dst, (int, np.integer)):
+			return self._edgeCost( int(src), int(dst) )
+
+		# A slice spans a whole row or column, crossed with an array in the other place
+		sliced = isinstance(src, slice) or isinstance(dst, slice)
+		if isinstance(src, slice):
+			src = np.arange( self.shape[0] )[src]
+		if isinstance(dst, slice):
+			dst = np.arange( self.shape[1] )[dst]
+		if sliced and np.ndim(src) and np.ndim(dst):
+			src = np.asarray( src )[..., np.newaxis]
+		src, dst = np.broadcast_arrays( np.asarray(src, dtype=np.intp), np.asarray(dst, dtype=np.intp) )
+		cost = np.sqrt( (self._xs[dst] - self._xs[src])**2 + (self._ys[dst] - self._ys[src])**2 )
+		if self._elevations is not None:
+			cost += self._elevations[dst] - self._elevations[src]
+			np.maximum( cost, 0.0, out=cost )
+		cost = np.ceil( cost * self._scale )
+		cost[~self._edges.exists(src, dst)] = self._missing
+		return cost.astype( self.dtype, copy=False )
+
+	def _edgeCost( self, src, dst ):
+		if not self._edges.exists( src, dst ):
+			return self._missing
+		dx = self._xl[dst] - self._xl[src]
+		dy = self._yl[dst] - self._yl[src]
+		cost = math.sqrt( dx*dx + dy*dy )
+		if self._el is not None:
+			cost = max( cost + (self._el[dst] - self._el[src]), 0.0 )
+		cost = math.ceil( cost * self._scale )
+		return float(cost) if self.dtype.kind == 'f' else cost
+
+
+
+# Whether costs[a, b] == costs[b, a] for every pair of cities
+# TIME: N^2 for a matrix, 1 for a CostView
+def isSymmetric( costs ):
+	if isinstance(costs, CostView):
+		return costs.symmetric
+	return np.array_equal( costs, costs.T )
+
+''' <summary>
+	Costs with every missing edge as the given whole number instead of infinity,
+	as dtype: a matrix is converted (an integer one already is and is returned as
+	it is), a CostView gives another view.
+	</summary> '''
+def withMissing( costs, missing, dtype=np.int64 ):
+	if isinstance(costs, CostView):
+		return costs.filled( missing, dtype )
+	if costs.dtype == dtype and np.issubdtype( costs.dtype, np.integer ):
+		return costs
+	return np.where( np.isinf(costs), missing, costs ).astype( dtype, copy=False )
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import queue
+import random
+import time
+
+from TSPCosts import withMissing
+from TSPGreedy import shareArray
+from TSPLocalSearch import LocalSearch
+from TSPParallel import RESULT_GRACE, TASK_WAIT, stopWorkers
+
+
+
+
+''' <summary>
+	Genetic (memetic) search over a population of tours.
+
+	Each generation breeds as many offspring as there are tours in the
+	population.  Both parents are picked by tournament selection; the child is
+	their order crossover (orderCrossover), is mutated with a random 2-opt move
+	(LocalSearch.mutate) with probability MUTATION_RATE, and is then polished
+	to a local optimum by LocalSearch.  The polish starts only from the cities on
+	edges that neither parent has, since the rest of the child is made of edges
+	that were already locally optimal.  The cheapest distinct tours among the
+	population and its offspring make up the next generation.
+
+	The first population is the seed tour, polished, and copies of it, each
+	given INITIAL_MUTATIONS random 2-opt moves per city before its polish.
+
+	Breeding, evaluation and polishing happen in the worker processes; the
+	main process only runs the selection.  Tours travel between processes as
+	int32 arrays, and the cost matrix is shared once, in the same int64 form
+	LocalSearch uses, so each worker keeps one LocalSearch for all of its
+	offspring.  A TSPCosts.CostView has no matrix to share and is sent to each
+	worker as it is.  With workers=1 everything runs in this process.
+	</summary> '''
+class GeneticSearch:
+
+	TOURNAMENT_SIZE = 3 # Tours drawn at random for each parent, the cheapest winning
+	MUTATION_RATE = 0.5 # Chance an offspring gets a random 2-opt move before its polish
+	INITIAL_MUTATIONS = 0.01 # Random 2-opt moves per city that make each first-generation tour from the seed
+
+	def __init__( self, costs, seed, neighbors, reversals=True, population=16, workers=1, rng=random ):
+		self._costs = withMissing( costs, LocalSearch.MISSING_EDGE )
+		self._seed = np.asarray( seed, dtype=np.int32 )
+		self._neighbors = neighbors
+		self._reversals = reversals
+		self._population = population
+		self._workers = workers
+		self._rng = rng
+		self.offspring = 0
+		self.survivors = 0
+
+	''' <summary>
+		Evolves the population until the deadline.
+		</summary>
+		<returns>a generator of (cost, tour) for every generation that ends with a
+		new best tour, counting a missing edge as LocalSearch.MISSING_EDGE; the
+		first is the best of the first generation</returns> '''
+	def evolve( self, deadline ):
+		if self._workers > 1:
+			breeder = _PoolBreeder( self._costs, self._neighbors, self._reversals, self._workers )
+		else:
+			breeder = _Breeder( self._costs, self._neighbors, self._reversals )
+
+		try:
+			kicks = max( 1, int(len(self._seed) * self.INITIAL_MUTATIONS) )
+			tasks = [ (self._seed, self._seed, kicks if i else 0, self._rng.getrandbits(32)) \
+					  for i in range(self._population) ]
+			members = self._survivors( [], breeder.breed( tasks, deadline ) )
+			best_cost = members[0][0]
+			yield best_cost, members[0][1]
+
+			while time.time() < deadline:
+				tasks = []
+				for _ in range(self._population):
+					first, second = self._tournament( members ), self._tournament( members )
+					mutations = 1 if self._rng.random() < self.MUTATION_RATE else 0
+					tasks.append( (first, second, mutations, self._rng.getrandbits(32)) )
+				children = breeder.breed( tasks, deadline )
+				self.offspring += len(children)
+				members = self._survivors( members, children )
+				self.survivors += sum( 1 for member in members if any(member is child for child in children) )
+
+				if members[0][0] < best_cost:
+					best_cost = members[0][0]
+					yield best_cost, members[0][1]
+		finally:
+			breeder.close()
+
+	# The cheapest of TOURNAMENT_SIZE members drawn at random
+	def _tournament( self, members ):
+		return min( (self._rng.choice(members) for _ in range(self.TOURNAMENT_SIZE)), key=lambda member: member[0] )[1]
+
+	# The next generation: the cheapest members and children, one per cost so
+	# copies of the same tour do not crowd out the rest, cheapest first
+	def _survivors( self, members, children ):
+		survivors, costs = [], set()
+		for member in sorted( members + children, key=lambda member: member[0] ):
+			if member[0] not in costs:
+				costs.add( member[0] )
+				survivors.append( member )
+		return survivors[:self._population]
+
+
+
+''' <summary>
+	Order crossover (OX): the child keeps a random slice of first in place, and
+	the rest of its cities follow in the order they come in second, starting
+	after the slice.
+	</summary>
+	<returns>the child as an int32 array</returns> '''
+def orderCrossover( first, second, rng ):
+	n = len(first)
+	i, j = sorted( rng.sample( range(n + 1), 2 ) )
+	taken = np.zeros( n, dtype=bool )
+	taken[first[i:j]] = True
+	rest = np.roll( second, -j )
+	rest = rest[~taken[rest]]
+	return np.concatenate( (rest[n-j:], first[i:j], rest[:n-j]) ).astype(np.int32)
+
+# Cities on the edges of the child that are not in either parent, both ends of each
+def _newEdgeCities( child, first, second ):
+	succ = np.empty( (2, len(child)), dtype=np.int32 )
+	succ[0, first] = np.roll( first, -1 )
+	succ[1, second] = np.roll( second, -1 )
+	following = np.roll( child, -1 )
+	new = (succ[0, child] != following) & (succ[1, child] != following)
+	return np.concatenate( (child[new], following[new]) ).tolist()
+
+# Breeds one child with the given search, which is left holding it
+# A tour crossed with itself is polished from every city, as it may not be a local optimum
+def _breed( search, first, second, mutations, seed, deadline ):
+	rng = random.Random( seed )
+	child = orderCrossover( first, second, rng )
+	search.setTour( child.tolist() )
+	touched = None if np.array_equal( first, second ) else _newEdgeCities( child, first, second )
+	for _ in range(mutations):
+		changed = search.mutate( rng )
+		if changed and touched is not None:
+			touched.extend( changed )
+	search.optimize( deadline, touched )
+	return search.cost, search.getTour().astype(np.int32)
+
+
+
+# Breeds children in this process, with one LocalSearch for all of them
+class _Breeder:
+
+	def __init__( self, costs, neighbors, reversals ):
+		self._search = LocalSearch( costs, list(range(len(costs))), neighbors, reversals )
+
+	# RETURNS: (cost, tour) for each task, in order
+	def breed( self, tasks, deadline ):
+		return [ _breed( self._search, *task, deadline ) for task in tasks ]
+
+	def close( self ):
+		pass
+
+# Breeds children in a pool of worker processes that share the cost matrix
+class _PoolBreeder:
+
+	def __init__( self, costs, neighbors, reversals, workers ):
+		context = multiprocessing.get_context()
+		self._tasks = context.Queue()
+		self._results = context.Queue()
+		if isinstance(costs, np.ndarray):
+			self._block = shareArray( costs )
+			view = (self._block.name, costs.shape, costs.dtype.str)
+		else:
+			self._block, view = None, costs
+		self._pool = [ context.Process( target=_breedWorker, \
+										args=(view, neighbors, reversals, self._tasks, self._results) ) \
+					   for _ in range(workers) ]
+		for process in self._pool:
+			process.start()
+
+	# RETURNS: (cost, tour) for the tasks, in the order they finish; each worker that
+	# dies takes its task with it, and the wait ends RESULT_GRACE seconds past the deadline
+	def breed( self, tasks, deadline ):
+		for task in tasks:
+			self._tasks.put( task + (deadline,) )
+		children = []
+		while len(children) < len(tasks) - self._lost():
+			try:
+				children.append( self._results.get( timeout=TASK_WAIT ) )
+			except queue.Empty:
+				if time.time() > deadline + RESULT_GRACE:
+					break
+		if tasks and not children:
+			raise RuntimeError('Breeding workers returned no offspring ({} of {} died)'.format( \
+							   self._lost(), len(self._pool) ))
+		return children
+
+	# Number of workers that died with an error
+	def _lost( self ):
+		return sum( 1 for process in self._pool if process.exitcode not in (None, 0) )
+
+	def close( self ):
+		for _ in self._pool:
+			self._tasks.put( None )
+		stopWorkers( self._pool )
+		if self._block is not None:
+			self._block.close()
+			self._block.unlink()
+
+def _breedWorker( view, neighbors, reversals, tasks, results ):
+	if isinstance(view, tuple):
+		name, shape, dtype = view
+		block = shared_memory.SharedMemory( name=name )
+		costs = np.ndarray( shape, dtype=dtype, buffer=block.buf )
+	else:
+		block, costs = None, view
+	breeder = _Breeder( costs, neighbors, reversals )
+
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+		*task, deadline = task
+		results.put( breeder.breed( [task], deadline )[0] )
+
+	# The arrays must let go of the shared buffer before it can be closed
+	del breeder, costs
+	if block is not None:
+		block.close()
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+
+
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import time
+
+from TSPParallel import collectResults, stopWorkers
+
+
+
+
+''' <summary>
+	Nearest-neighbor ("greedy") tours from many start cities.
+
+	Tours from a batch of start cities are built together, one row of a 2-D array
+	per start.  Each step looks up the next city in short per-city candidate lists
+	instead of scanning a whole row of the cost matrix.
+
+	The costs may be the cost matrix or a TSPCosts.CostView; candidate lists are
+	ranked a block of rows at a time, so neither needs more than one n x n array.
+
+	parallelGreedy splits the batches across a pool of worker processes.  The cost
+	matrix and candidate lists are placed in shared memory once, and every worker
+	maps them instead of receiving a pickled copy; a CostView is sent to each
+	worker as it is.  Workers claim batches from a
+	shared counter until none are left or the deadline passes, then send back only
+	their best tour.
+	</summary> '''
+
+NEAREST_BLOCK = 1 << 22 # Most costs nearestCandidates ranks at once
+
+
+
+
+# Indices of each city's k cheapest destinations, ordered by cost and then index
+# Costs are scaled integers, so cost * n + index is a unique key that sorts the same way
+# Rows are ranked NEAREST_BLOCK costs at a time
+# TIME: N^2
+# SPACE: N * K, plus NEAREST_BLOCK
+def nearestCandidates( costs, k ):
+	ncities = len(costs)
+	rows = max(1, NEAREST_BLOCK // max(ncities, 1))
+	return np.concatenate([_nearestRows(costs[first:first + rows], k, ncities) \
+						   for first in range(0, ncities, rows)])
+
+def _nearestRows( costs, k, ncities ):
+	key = costs * ncities + np.arange(ncities)
+	if k + 1 < ncities:
+		key_rows = np.arange(len(key))[:, None]
+		nearest = np.argpartition(key, k, axis=1)[:, :k]
+		return nearest[key_rows, np.argsort(key[key_rows, nearest], axis=1)]
+	return np.argsort(key, axis=1)
+
+# Builds the greedy tour from every city in starts at once, one row per start
+# Each step takes the first unvisited city in the current city's candidate list,
+# checked in rounds of the given widths; rows whose candidates are all visited
+# fall back to an argmin over the costs to the row's unvisited cities
+# Both pick the cheapest unvisited city, lowest index on ties
+# A row that runs into a missing edge gets an infinite total and stops there,
+# leaving the rest of its route unset
+# TIME: N * B * K, plus the cities left unvisited per fallback row
+# SPACE: B * N
+def greedyTours( costs, nearest, rounds, starts ):
+	ncities = len(costs)
+	routes = np.empty((len(starts), ncities), dtype=np.intp)
+	routes[:, 0] = starts
+	visited = np.zeros((len(starts), ncities), dtype=bool)
+	visited[np.arange(len(starts)), starts] = True
+	# Flat indices into visited are much cheaper to gather than 2-D ones
+	flat_visited = visited.reshape(-1)
+	totals = np.zeros(len(starts))
+	live = np.arange(len(starts))
+
+	for step in range(1, ncities):
+		current = routes[live, step - 1]
+		row_offsets = live * ncities
+		following = np.empty(len(live), dtype=np.intp)
+		missed = np.arange(len(live))
+		checked = 0
+		for width in rounds:
+			if checked >= nearest.shape[1]:
+				break
+			candidates = nearest[current[missed], checked:width]
+			unvisited = ~flat_visited[row_offsets[missed, None] + candidates]
+			pick = unvisited.argmax(axis=1)
+			found = unvisited[np.arange(len(missed)), pick]
+			following[missed[found]] = candidates[found, pick[found]]
+			missed = missed[~found]
+			checked = width
+			if not len(missed):
+				break
+
+		if len(missed):
+			# Every row has ncities - step cities left, listed in index order
+			unvisited = np.flatnonzero(~visited[live[missed]]).reshape(len(missed), -1)
+			unvisited -= np.arange(len(missed))[:, None] * ncities
+			options = costs[current[missed, None], unvisited]
+			pick = options.argmin(axis=1)
+			following[missed] = unvisited[np.arange(len(missed)), pick]
+		step_costs = costs[current, following]
+
+		totals[live] += step_costs
+		routes[live, step] = following
+		visited[live, following] = True
+		live = live[step_costs != math.inf]
+		if not len(live):
+			break
+
+	totals[live] += costs[routes[live, -1], starts[live]]
+	return routes, totals
+
+''' <summary>
+	Builds the greedy tours from the batches of start cities beginning at each
+	index in firsts, stopping early once the deadline has passed.
+	</summary>
+	<returns>the best tour's cost (inf if none could be completed), its route as
+	an array of city indices (or None) and the number of start cities tried.  Ties
+	go to the earliest start city.</returns> '''
+def bestGreedyTour( costs, nearest, rounds, firsts, batch_size, deadline ):
+	ncities = len(costs)
+	best_cost, best_route, count = math.inf, None, 0
+	for first in firsts:
+		if time.time() > deadline:
+			break
+		starts = np.arange(first, min(first + batch_size, ncities))
+		routes, totals = greedyTours(costs, nearest, rounds, starts)
+		count += len(starts)
+
+		# argmin keeps the earliest start on ties
+		best = np.argmin(totals)
+		if totals[best] < best_cost:
+			best_cost, best_route = totals[best], routes[best]
+	return best_cost, best_route, count
+
+''' <summary>
+	bestGreedyTour over every start city, with the batches shared out between a
+	pool of worker processes.
+	</summary>
+	<returns>the same as bestGreedyTour</returns> '''
+def parallelGreedy( costs, nearest, rounds, batch_size, deadline, workers ):
+	context = multiprocessing.get_context()
+	next_first = context.Value( 'i', 0 )
+	results = context.Queue()
+	shared = [ costs, nearest ] if isinstance(costs, np.ndarray) else [ nearest ]
+	blocks = [ shareArray(array) for array in shared ]
+
+	try:
+		views = [ (block.name, array.shape, array.dtype.str) for block, array in zip(blocks, shared) ]
+		if len(shared) == 1:
+			views.insert( 0, costs )
+		pool = [ context.Process( target=_greedyWorker, \
+								  args=(views, rounds, batch_size, next_first, results, deadline) ) \
+				 for _ in range(workers) ]
+		for process in pool:
+			process.start()
+
+		# Collect before joining, so no worker blocks flushing its result; a worker
+		# that dies or overruns the deadline only loses its share of the start cities
+		best_cost, best_route, count = math.inf, None, 0
+		for cost, route, tried in collectResults( results, pool, deadline ):
+			count += tried
+			# Same tie-break as the serial search: the earliest start city wins
+			if route is not None and (cost < best_cost or (cost == best_cost and route[0] < best_route[0])):
+				best_cost, best_route = cost, route
+		stopWorkers( pool )
+	finally:
+		for block in blocks:
+			block.close()
+			block.unlink()
+	return best_cost, best_route, count
+
+# Copies an array into a new shared memory block (also used by TSPGenetic)
+def shareArray( array ):
+	block = shared_memory.SharedMemory( create=True, size=max(array.nbytes, 1) )
+	np.ndarray( array.shape, dtype=array.dtype, buffer=block.buf )[...] = array
+	return block
+
+# Yields the first start city of each batch this worker claims from the shared counter
+def _claimedBatches( next_first, ncities, batch_size ):
+	while True:
+		with next_first.get_lock():
+			first = next_first.value
+			next_first.value = min(first + batch_size, ncities)
+		if first >= ncities:
+			return
+		yield first
+
+# Each view is a shared array's (name, shape, dtype), or costs to use as they are
+def _greedyWorker( views, rounds, batch_size, next_first, results, deadline ):
+	blocks = [ shared_memory.SharedMemory( name=view[0] ) if isinstance(view, tuple) else None \
+			   for view in views ]
+	costs, nearest = [ np.ndarray( view[1], dtype=view[2], buffer=block.buf ) if block is not None else view \
+					   for block, view in zip(blocks, views) ]
+
+	cost, route, count = bestGreedyTour( costs, nearest, rounds, \
+										 _claimedBatches(next_first, len(costs), batch_size), \
+										 batch_size, deadline )
+	results.put( (float(cost), route, count) )
+
+	# The arrays must let go of the shared buffers before they can be closed
+	del costs, nearest
+	for block in blocks:
+		if block is not None:
+			block.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+
+import math
+import numpy as np
+import time
+
+
+
+
+''' <summary>
+	Held-Karp dynamic programming: the cheapest path from start to end through
+	every one of a set of k cities, in O(2^k k^2) time and O(2^k k) space.
+
+	best[mask, j] is the cheapest path from start through exactly the cities in
+	bitmask 'mask' (bit i for cities[i]) ending at cities[j].  The table is one
+	NumPy array with a row per subset, filled a layer of equal-sized subsets at a
+	time; within a layer, every subset holding city j is done with one gather of
+	the rows without j and one min over the predecessor axis.  Paths that are not
+	possible stay infinite, so missing edges and asymmetric costs need no special
+	handling.  The path is read back from the table itself rather than from a
+	separate table of predecessors.
+
+	The table is float32 whenever every path cost is a whole number float32 holds
+	exactly, which halves its size; heldKarpBytes estimates the memory a run needs
+	so callers can refuse or fall back before starting it.
+	</summary> '''
+
+
+
+
+# Smallest float type that holds the cost of any path through count cities exactly
+def tableType( costs, count ):
+	finite = costs[np.isfinite(costs)]
+	largest = finite.max() if len(finite) else 0
+	return np.float32 if largest * (count + 1) < 2**24 else np.float64
+
+# Rough peak memory of heldKarpPath on count cities: the table, the subset
+# bookkeeping and the gather for the largest layer
+def heldKarpBytes( count, dtype=np.float64 ):
+	itemsize = np.dtype(dtype).itemsize
+	layer = math.comb( count, count // 2 )
+	return (1 << count) * (count * itemsize + 9) + 2 * layer * count * itemsize
+
+
+
+''' <summary>
+	Finds the cheapest path from start to end that visits every city in cities
+	once.  start and end may be the same city, which makes it a tour.  Gives up
+	if the deadline passes, checking between layers.
+	</summary>
+	<returns>(cost, path) with path the order in which cities are visited (start
+	and end excluded), (inf, None) if every such path uses a missing edge, or
+	None if the deadline passed first</returns> '''
+def heldKarpPath( costs, start, end, cities, deadline=None ):
+	cities = np.asarray( cities, dtype=np.intp )
+	k = len(cities)
+	if k == 0:
+		return costs[start, end], []
+	dtype = tableType( costs, k )
+	inner = costs[np.ix_(cities, cities)].astype(dtype)
+	first = costs[start, cities].astype(dtype)
+	last = costs[cities, end].astype(dtype)
+
+	# Subsets grouped by size: popcount by doubling, then a stable sort
+	sizes = np.zeros( 1, dtype=np.uint8 )
+	for _ in range(k):
+		sizes = np.concatenate( (sizes, sizes + 1) )
+	bySize = np.argsort( sizes, kind='stable' )
+	bounds = np.cumsum( np.bincount( sizes, minlength=k+1 ) )
+
+	best = np.full( (1 << k, k), np.inf, dtype=dtype )
+	best[1 << np.arange(k), np.arange(k)] = first
+	for size in range(2, k+1):
+		if deadline is not None and time.time() > deadline:
+			return None
+		layer = bySize[bounds[size-1]:bounds[size]]
+		for j in range(k):
+			masks = layer[(layer >> j) & 1 == 1]
+			best[masks, j] = (best[masks ^ (1 << j)] + inner[:, j]).min( axis=1 )
+
+	# Walk back from the cheapest ending: each step's predecessor is the city whose
+	# entry plus the edge into the current city matches the current entry
+	mask = (1 << k) - 1
+	ends = best[mask] + last
+	j = int( np.argmin(ends) )
+	cost = ends[j]
+	if cost == np.inf:
+		return np.inf, None
+	path = [j]
+	while mask != 1 << j:
+		mask ^= 1 << j
+		j = int( np.argmin( best[mask] + inner[:, j] ) )
+		path.append( j )
+	path.reverse()
+	return int(cost), cities[path].tolist()
@@ -0,0 +1,430 @@
+#!/usr/bin/python3
+
+
+from collections import deque
+import numpy as np
+import random
+import time
+
+from TSPCosts import isSymmetric, withMissing
+from TSPTour import Tour
+
+
+
+
+''' <summary>
+	Local search over a tour stored as a two-level list (TSPTour.Tour).
+
+	Every candidate move is scored from the handful of edges it changes, using
+	the scenario's cost matrix.  Because costs are asymmetric, a move that
+	reverses a segment also changes the cost of the edges inside that segment;
+	those come from the Tour's prefix sums in O(1), after O(sqrt n) upkeep per
+	flip.  Symmetric costs (Easy mode) need no sums, so the Tour keeps none.
+	Every accepted move is applied as one to three Tour flips, each O(sqrt n),
+	so nothing is rebuilt in O(n).
+
+	Moves are only tried when they create an edge from a city to one of its
+	candidate neighbors (Scenario.neighborLists), and "don't-look bits" keep a
+	city out of the work queue until one of its tour edges changes, so a sweep
+	costs O(n * k) instead of O(n^2).
+
+	With reversals=False only the moves that keep every city's orientation are
+	used (forward Or-opt and the 3-opt segment exchange).  Each is scored from
+	its three changed edges alone, which suits strongly asymmetric costs where
+	reversed segments rarely pay off.
+
+	With variableDepth=True the single 2-opt move is replaced by a Lin-Kernighan
+	style chain of them (linKernighan).
+
+	iterate keeps going past the first local optimum: it kicks the tour, repairs
+	the damage with the same moves and keeps the result if it is no worse,
+	yielding every new best tour until the deadline.
+	</summary> '''
+class LocalSearch:
+
+	# Stand-in for a missing edge so tour costs fit in int64 prefix sums.
+	# Large enough that no move introducing one can ever look like an improvement.
+	MISSING_EDGE = 2**40
+
+	LK_DEPTH = 10 # Most 2-opt steps in one Lin-Kernighan chain
+	LK_BREADTH = 1 # First steps a Lin-Kernighan move tries before giving up; more is thorough but slow
+
+	ILS_KICK_SPAN = 50 # Longest segment a double-bridge kick moves
+	ILS_RESTART_AFTER = 200 # Kicks in a row without a new best tour before a segment-random restart
+	ILS_RESTART_FRACTION = 0.1 # Share of the tour a restart shuffles
+
+	def __init__( self, costs, tour, neighbors, reversals=True, variableDepth=False ):
+		self.reversals = reversals
+		self.variableDepth = variableDepth
+		# A matrix already in this form is used as it is, so processes can share one
+		self._costs = withMissing( costs, self.MISSING_EDGE )
+		self._symmetric = isSymmetric( self._costs )
+		self._n = len(tour)
+		self._neighbors = [ nbrs.tolist() for nbrs in neighbors ]
+		self.improvements = 0
+		self._journal = None
+		self._setTour( tour )
+
+	# Starts over from a new tour, keeping the costs and candidate neighbors
+	def setTour( self, order ):
+		self.improvements = 0
+		self._setTour( order )
+
+	def _setTour( self, order ):
+		self._tour = Tour( order, self._costs, symmetric=self._symmetric )
+		self._succ = self._tour.next
+		self._pred = self._tour.prev
+
+	@property
+	def cost( self ):
+		return self._tour.cost
+
+	def getTour( self ):
+		return np.array( self._tour.order(), dtype=np.intp )
+
+	# Change in cost of the edges inside the tour path first -> ... -> last
+	# when that path is walked backwards instead
+	def _reversalDelta( self, first, last ):
+		if self._symmetric:
+			return 0
+		fwd, bwd = self._tour.pathCosts( first, last )
+		return bwd - fwd
+
+	# Reverses the tour path a -> ... -> b, noting it in the journal if one is being kept
+	def _flip( self, a, b ):
+		self._tour.flip( a, b )
+		if self._journal is not None:
+			self._journal.append( (a, b) )
+
+
+
+	''' <summary>
+		Works through a queue of cities, trying each move type around the city
+		until one improves the tour.  The endpoints of every edge a move changes
+		go back on the queue; a city that yields no improvement stays off it.
+		Stops when the queue is empty (a local optimum) or the deadline passes.
+		The queue starts with the given cities, or every city if none are given.
+		</summary>
+		<returns>True if the tour reached a local optimum before the deadline</returns>
+	'''
+	def optimize( self, deadline, cities=None ):
+		if self.variableDepth:
+			moves = [self.linKernighan, self.orOpt, self.threeOpt]
+		elif self.reversals:
+			moves = [self.twoOpt, self.orOpt, self.threeOpt]
+		else:
+			moves = [self.orOpt, self.threeOpt]
+
+		active = deque( self._tour.order() if cities is None else dict.fromkeys(cities) )
+		queued = np.zeros( self._n, dtype=bool )
+		queued[list(active)] = True
+		while active:
+			if time.time() > deadline:
+				return False
+			city = active.popleft()
+			queued[city] = False
+			for move in moves:
+				changed = move(city)
+				if changed:
+					for endpoint in changed:
+						if not queued[endpoint]:
+							queued[endpoint] = True
+							active.append( endpoint )
+					break
+		return True
+
+
+
+	# 2-opt: remove edges (a,b) and (c,d), reconnect as (a,c),(b,d) and reverse b..c
+	# Tries every candidate c for a's new successor, and every candidate d for the
+	# new successor of b when 'city' plays the part of b
+	# TIME: K to score, sqrt(N) to apply
+	# RETURNS: the endpoints of the changed edges, or None
+	def twoOpt( self, city ):
+		if self._n < 4:
+			return None
+		C = self._costs
+		best_gain, best = 0, None
+
+		a = city
+		b = self._succ(a)
+		for c in self._neighbors[a]:
+			if c == b:
+				continue
+			d = self._succ(c)
+			gain = C[a,b] + C[c,d] - C[a,c] - C[b,d] - self._reversalDelta( b, c )
+			if gain > best_gain:
+				best_gain, best = gain, (a, b, c, d)
+
+		b = city
+		a = self._pred(b)
+		for d in self._neighbors[b]:
+			c = self._pred(d)
+			if c == b:
+				continue
+			gain = C[a,b] + C[c,d] - C[a,c] - C[b,d] - self._reversalDelta( b, c )
+			if gain > best_gain:
+				best_gain, best = gain, (a, b, c, d)
+
+		if best is None:
+			return None
+
+		a, b, c, d = best
+		self._flip( b, c )
+		self.improvements += 1
+		return best
+
+	# Lin-Kernighan: a chain of 2-opt moves that all start from t1 = 'city'
+	# Each step removes t1's current tour edge (t1,b) and an edge (c,d), where d is a
+	# candidate for b's new successor, then adds (t1,c) and (b,d) and reverses b..c.
+	# The chain's open gain, the saving if the last (t1,c) edge cost nothing, must stay
+	# above the best saving found so far; each step takes the candidate that keeps it
+	# largest, and an edge added by the chain is never removed again.  The chain is
+	# cut back to its cheapest tour by undoing the flips past it, last first.
+	# If a chain finds nothing, it is retried from the next best first step, up to
+	# LK_BREADTH first steps in all.
+	# TIME: K + sqrt(N) per step, up to LK_BREADTH * LK_DEPTH steps
+	# RETURNS: the endpoints of the changed edges, or None
+	def linKernighan( self, city ):
+		if self._n < 4:
+			return None
+		C = self._costs
+		t1 = city
+		b = self._succ(t1)
+		gain = C[t1, b]
+
+		firsts = []
+		for d in self._neighbors[b]:
+			c = self._pred(d)
+			if c != b:
+				firsts.append( (gain + C[c,d] - C[b,d] - self._reversalDelta( b, c ), c, d) )
+		firsts.sort( reverse=True )
+
+		for first_gain, c, d in firsts[:self.LK_BREADTH]:
+			if first_gain <= 0:
+				break
+			changed = self._kernighanChain( t1, first_gain, c, d )
+			if changed:
+				self.improvements += 1
+				return changed
+		return None
+
+	# Applies the first step b..c of a Lin-Kernighan chain from t1, then extends it
+	# Leaves the tour at the chain's cheapest point and returns the endpoints of the
+	# edges changed up to there, or undoes the whole chain and returns None
+	# After each step the tour closes with (t1,c), so it has saved gain - C[t1,c]
+	def _kernighanChain( self, t1, gain, c, d ):
+		C = self._costs
+		best_saving, best_depth = 0, 0
+		added = set()
+		steps = []
+
+		for depth in range( 1, self.LK_DEPTH + 1 ):
+			b = self._succ(t1)
+			if depth > 1:
+				# A step whose open gain cannot beat the best tour so far is not worth taking
+				best_gain, move = best_saving, None
+				for d in self._neighbors[b]:
+					c = self._pred(d)
+					if c == b or (c, d) in added:
+						continue
+					step_gain = gain + C[c,d] - C[b,d] - self._reversalDelta( b, c )
+					if step_gain > best_gain:
+						best_gain, move = step_gain, (c, d)
+				if move is None:
+					break
+				c, d = move
+				gain = best_gain
+
+			steps.append( (b, c, d) )
+			self._flip( b, c )
+			added.add( (b, d) )
+			saving = gain - C[t1, c]
+			if saving > best_saving:
+				best_saving, best_depth = saving, depth
+
+		# Flipping c..b back undoes the step that reversed b..c
+		for b, c, d in reversed(steps[best_depth:]):
+			self._flip( c, b )
+		if best_depth == 0:
+			return None
+		return { t1 } | { city for step in steps[:best_depth] for city in step }
+
+	# Or-opt: move a segment of 1-3 cities between two other neighboring cities c -> d
+	# Forward: the segment ends at 'city' and 'city' gets a candidate d as its new successor
+	# Reversed: the segment starts at 'city', is flipped, and 'city' gets d as its successor
+	# (only tried when reversals are on)
+	# TIME: K to score each segment length, sqrt(N) to apply
+	# RETURNS: the endpoints of the changed edges, or None
+	def orOpt( self, city ):
+		C = self._costs
+		best_gain, best = 0, None
+
+		for length in range( 1, 4 ):
+			if self._n - length < 3:
+				break
+
+			for reverse in ((False, True) if self.reversals else (False,)):
+				if reverse:
+					first = last = city
+					for _ in range( length - 1 ):
+						last = self._succ(last)
+					reversal = self._reversalDelta( first, last )
+				else:
+					first = last = city
+					for _ in range( length - 1 ):
+						first = self._pred(first)
+					reversal = 0
+				p, f = self._pred(first), self._succ(last)
+				removed = C[p,first] + C[last,f] - C[p,f] - reversal
+
+				for d in self._neighbors[city]:
+					c = self._pred(d)
+					if self._tour.between( first, d, last ) or self._tour.between( first, c, last ):
+						continue
+					if reverse:
+						gain = removed + C[c,d] - C[c,last] - C[first,d]
+					else:
+						gain = removed + C[c,d] - C[c,first] - C[last,d]
+					if gain > best_gain:
+						best_gain, best = gain, (p, f, c, d, first, last, length, reverse)
+
+		if best is None:
+			return None
+
+		p, f, c, d, first, last, length, reverse = best
+		# p first..last f ... c d  becomes  p f ... c last..first d, then the segment is turned back
+		self._flip( first, c )
+		self._flip( c, f )
+		if not reverse:
+			self._flip( last, first )
+		self.improvements += 1
+		return (p, f, c, d, first, last)
+
+	# 3-opt segment exchange: a | b..c | d..e | f  becomes  a | d..e | b..c | f
+	# Neither segment is reversed, so only the three boundary edges change cost
+	# a = 'city', d is a candidate for a's new successor and f a candidate for c's
+	# TIME: K^2 to score, sqrt(N) to apply
+	# RETURNS: the endpoints of the changed edges, or None
+	def threeOpt( self, city ):
+		if self._n < 4:
+			return None
+		C = self._costs
+		best_gain, best = 0, None
+
+		a = city
+		b = self._succ(a)
+		for d in self._neighbors[a]:
+			if d == a or d == b:
+				continue
+			c = self._pred(d)
+			removed = C[a,b] + C[c,d] - C[a,d]
+			for f in self._neighbors[c]:
+				e = self._pred(f)
+				# e has to be d or come after it
+				if self._tour.between( a, e, c ):
+					continue
+				gain = removed + C[e,f] - C[e,b] - C[c,f]
+				if gain > best_gain:
+					best_gain, best = gain, (a, b, c, d, e, f)
+
+		if best is None:
+			return None
+
+		a, b, c, d, e, f = best
+		# a b..c d..e f  becomes  a e..d c..b f, then each segment is turned back
+		self._flip( b, e )
+		self._flip( e, d )
+		self._flip( c, b )
+		self.improvements += 1
+		return best
+
+
+
+	''' <summary>
+		Iterated local search.  After optimize reaches a local optimum, each round
+		kicks the tour with a random double-bridge move and runs optimize from the
+		cities around it.  The round is kept if the tour is no worse than before the
+		kick (so the search can drift across plateaus), and otherwise every flip
+		since the kick is undone.  After ILS_RESTART_AFTER rounds in a row without
+		a new best tour, a segment-random restart shuffles a random stretch of the
+		tour instead and is always kept, to get out of a basin the kicks keep
+		falling back into.  Runs until the deadline.
+		</summary>
+		<returns>a generator of (cost, tour) for each new best tour, the first one
+		being the local optimum the search starts from; the search's own tour is
+		left wherever the last round put it, which may be worse</returns> '''
+	def iterate( self, deadline, rng=random ):
+		self.optimize( deadline )
+		best_cost = self.cost
+		yield best_cost, self.getTour()
+		if self._n < 8:
+			return
+
+		stale = 0
+		while time.time() < deadline:
+			if stale >= self.ILS_RESTART_AFTER:
+				self.optimize( deadline, self._scramble(rng) )
+				stale = 0
+			else:
+				before = self.cost
+				self._journal = []
+				self.optimize( deadline, self._doubleBridge(rng) )
+				journal, self._journal = self._journal, None
+				if self.cost > before:
+					for a, b in reversed(journal):
+						self._tour.flip( b, a )
+
+			if self.cost < best_cost:
+				best_cost, stale = self.cost, 0
+				yield best_cost, self.getTour()
+			else:
+				stale += 1
+
+	# Double-bridge kick: a | b..c | d..e | f  becomes  a | d..e | b..c | f, the same
+	# exchange as threeOpt, with a random a and segments of 1 to ILS_KICK_SPAN cities
+	# TIME: ILS_KICK_SPAN + sqrt(N)
+	# RETURNS: the endpoints of the changed edges
+	def _doubleBridge( self, rng ):
+		span = min( self.ILS_KICK_SPAN, (self._n - 2) // 2 )
+		a = rng.randrange( self._n )
+		b = c = self._succ(a)
+		for _ in range( rng.randrange(span) ):
+			c = self._succ(c)
+		d = e = self._succ(c)
+		for _ in range( rng.randrange(span) ):
+			e = self._succ(e)
+		f = self._succ(e)
+		self._flip( b, e )
+		self._flip( e, d )
+		self._flip( c, b )
+		return (a, b, c, d, e, f)
+
+	# Mutation for the genetic solver (TSPGenetic): twoOpt's move from a random city a
+	# to a random one of its candidate neighbors c, made whatever it costs
+	# TIME: sqrt(N)
+	# RETURNS: the endpoints of the changed edges, or None if there is no such move
+	def mutate( self, rng ):
+		a = rng.randrange( self._n )
+		b = self._succ(a)
+		if self._n < 4 or not self._neighbors[a]:
+			return None
+		c = rng.choice( self._neighbors[a] )
+		if c == b:
+			return None
+		d = self._succ(c)
+		self._flip( b, c )
+		return (a, b, c, d)
+
+	# Segment-random restart: shuffles ILS_RESTART_FRACTION of the tour starting at a random city
+	# TIME: N, to rebuild the Tour
+	# RETURNS: the shuffled cities and their neighbors either side
+	def _scramble( self, rng ):
+		order = self._tour.order()
+		start = rng.randrange( self._n )
+		order = order[start:] + order[:start]
+		length = max( 2, int(self._n * self.ILS_RESTART_FRACTION) )
+		stretch = order[:length]
+		rng.shuffle( stretch )
+		self._setTour( stretch + order[length:] )
+		return stretch + [ order[length], order[-1] ]
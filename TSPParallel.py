@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+
+import multiprocessing
+import numpy as np
+import queue
+import time
+
+from TSPClasses import bbState, bbQueue
+from TSPBounds import BOUNDS
+
+
+
+
+''' <summary>
+	Multi-process branch-and-bound.
+
+	The caller expands the first levels of the search tree itself and hands the
+	resulting states to parallelSearch, which spreads them over a pool of worker
+	processes through a shared task queue.  Each worker runs the usual search on
+	its own bbQueue, pruning against a best-so-far cost kept in shared memory, so
+	a tour found by any worker tightens every other worker's pruning at once.
+
+	Work-stealing: when some workers are idle and the task queue is empty, a busy
+	worker hands its shallowest states (the largest subtrees) back to the task
+	queue every DONATE_EVERY expansions.  The search ends when every worker is
+	idle with nothing left in the task queue, or at the deadline.
+	</summary> '''
+
+DONATE_EVERY = 16 # Expansions between checks for idle workers
+TASK_WAIT = 0.05 # Seconds a worker waits on the task queue before rechecking for the end
+RESULT_GRACE = 5.0 # Seconds past the deadline to wait for workers' results before giving up on them
+
+
+
+
+''' <summary>
+	Searches below the given states with a pool of worker processes until the
+	search space is exhausted or the deadline passes.
+	</summary>
+	<returns>dictionary with the best tour found ('cost' and 'route', a list of
+	city indices, or None if nothing beat incumbent), the number of times a worker
+	improved the shared incumbent ('count'), the sum of the workers' largest
+	queue sizes ('max'), states generated ('total') and pruned ('pruned'), and the
+	number of workers that died or hung without reporting ('lost'); with any lost,
+	the search below their states is incomplete</returns> '''
+def parallelSearch( costs, bound, strategy, max_states, states, incumbent, deadline, workers ):
+	context = multiprocessing.get_context()
+	tasks = context.Queue()
+	results = context.Queue()
+	best = context.Value( 'd', incumbent )
+	# pending counts states in the task queue, idle counts workers waiting on it;
+	# both are only read or written while holding control
+	control = context.Lock()
+	pending = context.RawValue( 'i', len(states) )
+	idle = context.RawValue( 'i', 0 )
+
+	for state in states:
+		tasks.put( state )
+
+	pool = [ context.Process( target=_searchWorker, \
+							  args=(costs, bound, strategy, max_states, tasks, results, \
+									best, control, pending, idle, workers, deadline) ) \
+			 for _ in range(workers) ]
+	for process in pool:
+		process.start()
+
+	# Collect before joining, so no worker blocks flushing its result
+	combined = { 'cost': incumbent, 'route': None, 'count': 0, 'max': 0, 'total': 0, 'pruned': 0 }
+	received = collectResults( results, pool, deadline )
+	for cost, route, stats in received:
+		if route is not None and cost < combined['cost']:
+			combined['cost'], combined['route'] = cost, route
+		for key in ('count', 'max', 'total', 'pruned'):
+			combined[key] += stats[key]
+	combined['lost'] = workers - len(received)
+	stopWorkers( pool )
+
+	# Anything still queued when the deadline hit was never searched
+	while True:
+		try:
+			tasks.get( timeout=TASK_WAIT )
+		except queue.Empty:
+			break
+		combined['pruned'] += 1
+	return combined
+
+''' <summary>
+	Gathers one result from each worker in pool off the results queue, without
+	hanging on a worker that dies first (one that exits with an error before
+	sending its result) or one still running RESULT_GRACE seconds after the
+	deadline.
+	</summary>
+	<returns>the results received, in the order they came</returns> '''
+def collectResults( results, pool, deadline ):
+	received = []
+	while len(received) < len(pool) - sum( 1 for process in pool if process.exitcode not in (None, 0) ):
+		try:
+			received.append( results.get( timeout=TASK_WAIT ) )
+		except queue.Empty:
+			if time.time() > deadline + RESULT_GRACE:
+				break
+	return received
+
+# Joins the workers, terminating any that do not exit within TASK_WAIT seconds
+def stopWorkers( pool ):
+	for process in pool:
+		process.join( TASK_WAIT )
+		if process.is_alive():
+			process.terminate()
+			process.join()
+
+# Takes the next task, or returns None once every worker is idle with nothing queued
+def _nextTask( tasks, control, pending, idle, workers, deadline ):
+	with control:
+		idle.value += 1
+	while time.time() < deadline:
+		with control:
+			if pending.value > 0:
+				try:
+					state = tasks.get_nowait()
+				except queue.Empty:
+					state = None # still in flight from the putting process
+				if state is not None:
+					pending.value -= 1
+					idle.value -= 1
+					return state
+			elif idle.value == workers:
+				return None
+		time.sleep( TASK_WAIT )
+	return None
+
+def _searchWorker( costs, bound, strategy, max_states, tasks, results, best, control, pending, idle, workers, deadline ):
+	ncities = len(costs)
+	lowerBound = BOUNDS[bound](costs)
+	q = bbQueue( strategy, max_size=max_states )
+	stats = { 'count': 0, 'max': 0, 'total': 0, 'pruned': 0 }
+	bestCost, bestRoute = np.inf, None
+	expansions = 0
+
+	while True:
+		if not q:
+			state = _nextTask( tasks, control, pending, idle, workers, deadline )
+			if state is None:
+				break
+			q.push( state )
+
+		while q and time.time() < deadline:
+			stats['max'] = max( stats['max'], q.inMemory() )
+			state = q.pop()
+			bssfCost = best.value
+
+			if state.lowerBound > bssfCost:
+				stats['pruned'] += 1
+				continue
+
+			if state.depth == ncities - 1:
+				route = state.getRoute()
+				cost = costs[route, np.roll(route, -1)].sum()
+				q.foundSolution()
+				with best.get_lock():
+					improved = cost < best.value
+					if improved:
+						best.value = cost
+				if improved:
+					bestCost, bestRoute = cost, route
+					stats['count'] += 1
+				continue
+
+			for dest, childCost, childData in lowerBound.children( state, bssfCost, deadline ):
+				stats['total'] += 1
+				if childCost < bssfCost:
+					q.push( bbState(state, dest, childData, childCost) )
+				else:
+					stats['pruned'] += 1
+			state.boundData = None
+
+			# Work-stealing: give idle workers some of the biggest subtrees
+			expansions += 1
+			if expansions % DONATE_EVERY == 0 and len(q) > 1 and idle.value > 0 and pending.value == 0:
+				donated = q.steal( min( idle.value, len(q) // 2 ) )
+				with control:
+					pending.value += len(donated)
+				for state in donated:
+					tasks.put( state )
+
+		if time.time() >= deadline:
+			break
+
+	stats['pruned'] += len(q) + q.dropped
+	results.put( (float(bestCost), bestRoute, stats) )
@@ -1,34 +1,82 @@
 #!/usr/bin/python3
 
-from which_pyqt import PYQT_VER
-if PYQT_VER == 'PYQT5':
-	from PyQt5.QtCore import QLineF, QPointF
-elif PYQT_VER == 'PYQT4':
-	from PyQt4.QtCore import QLineF, QPointF
-else:
-	raise Exception('Unsupported Version of PyQt: {}'.format(PYQT_VER))
-
-
-
+# The solver core does not import Qt: scenarios can be built from coordinate
+# arrays (Scenario.fromCoordinates) and solved with no display, as the GUI is
+# only one client of it
 
 import time
 import numpy as np
 from TSPClasses import *
-import heapq
-import itertools
-import random
-from copy import deepcopy
+from TSPGreedy import nearestCandidates, bestGreedyTour, parallelGreedy
+from TSPConstruct import greedyEdgeTour, insertionTour, hilbertTour
+from TSPLocalSearch import LocalSearch
+from TSPAnneal import Annealer
+from TSPHeldKarp import heldKarpPath, heldKarpBytes, tableType
+from TSPGenetic import GeneticSearch
+from TSPBounds import BOUNDS
+from TSPParallel import parallelSearch
+import os
 
 
 
 
 class TSPSolver:
-	def __init__( self, gui_view ):
+
+	FANCY_GREEDY_TIME_FRACTION = 0.25 # Share of fancy's time allowance given to the initial greedy tour
+	NEIGHBORS = 10 # Candidate neighbors per city tried by the local search moves
+	GREEDY_BATCH_SIZE = 256 # Start cities greedy advances together
+	GREEDY_VIEW_BATCH_SIZE = 8 # The same past Scenario.DENSE_COST_CITIES, where each start is slower
+	GREEDY_CANDIDATES = (16, 256) # Rounds of cheapest destinations checked before a full row scan
+	GREEDY_EDGE_CANDIDATES = 10 # Cheapest edges out of each city that greedy-edge considers
+	SA_BATCH_SIZE = 1024 # Moves simulated annealing proposes and scores together
+	SA_REHEATS = 2 # Extra cooling runs simulated annealing restarts from its best tour
+	GA_POPULATION = 16 # Tours the genetic solver keeps from one generation to the next
+	GA_PARALLEL_POPULATION = 8 # Smallest population the genetic solver breeds in worker processes by default
+	HK_MEMORY_LIMIT = 512 * 1024**2 # Default ceiling, in bytes, on the Held-Karp table
+	FANCY_HELD_KARP_CITIES = 16 # Instances fancy solves exactly with Held-Karp instead, when asked to
+
+	BB_MEMORY_LIMIT = 2 * 1024**3 # Default ceiling, in bytes, on the branch-and-bound queue
+	BB_STATE_OVERHEAD_BYTES = 250 # Rough per-state cost of the bbState object and array header
+	BB_TRIM_FRACTION = 0.75 # Share of the memory ceiling left after dropping states
+	BB_SEED_TIME_FRACTION = 0.1 # Share of the allowance spent finding the initial BSSF
+	BB_SPLIT_DEPTH = 2 # Levels expanded before handing subtrees to parallel workers
+	BB_HELD_KARP_CITIES = 20 # Instances branch-and-bound solves exactly with Held-Karp instead, when asked to
+
+	# (label, method) for every algorithm a client can offer, in the GUI's order
+	ALGORITHMS = [ \
+		('Default','defaultRandomTour'), \
+		('Greedy','greedy'), \
+		('Greedy Edge','greedyEdge'), \
+		('Cheapest Insertion','cheapestInsertion'), \
+		('Farthest Insertion','farthestInsertion'), \
+		('Space-Filling Curve','spaceFillingCurve'), \
+		('Branch and Bound','branchAndBound'), \
+		('Held-Karp','heldKarp'), \
+		('Fancy','fancy'), \
+		('Iterated Local Search','iteratedLocalSearch'), \
+		('Simulated Annealing','simulatedAnnealing'), \
+		('Genetic','genetic'), \
+		('Lin-Kernighan','linKernighan') \
+	]
+
+	# gui_view is the GUI's view when the GUI runs the solver, None otherwise
+	def __init__( self, gui_view=None ):
 		self._scenario = None
+		self._view = gui_view
 
 	def setupWithScenario( self, scenario ):
 		self._scenario = scenario
 
+	''' <summary>
+		Runs one of ALGORITHMS, named by its method, on the current scenario,
+		passing any options on to it.
+		</summary>
+		<returns>the algorithm's results dictionary</returns> '''
+	def solve( self, algorithm, time_allowance=60.0, **options ):
+		if algorithm not in [method for _, method in self.ALGORITHMS]:
+			raise ValueError('Unsupported algorithm: {}'.format(algorithm))
+		return getattr( self, algorithm )( time_allowance=time_allowance, **options )
+
 
 	''' <summary>
 		This is the entry point for the default solver
@@ -77,6 +125,12 @@ class TSPSolver:
 		the group project (but it is probably a good idea to just do it for the branch-and
 		bound project as a way to get your feet wet).  Note this could be used to find your
 		initial BSSF.
+		A tour is built from every start city; batch_size of them (GREEDY_BATCH_SIZE by
+		default, GREEDY_VIEW_BATCH_SIZE when the costs are a CostView) are advanced
+		together as rows of 2-D arrays, and batch_size=1 builds them one at a time.
+		The time allowance is checked between batches.
+		With workers > 1 the batches are shared out between that many processes,
+		which read the cost matrix from shared memory (see TSPGreedy).
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution, 
 		time spent to find best solution, total number of solutions found, the best
@@ -84,67 +138,33 @@ class TSPSolver:
 		algorithm</returns> 
 	'''
 
-	def greedy( self,time_allowance=60.0 ):
-
+	def greedy( self, time_allowance=60.0, batch_size=None, workers=1 ):
 		cities = self._scenario.getCities()
+		costs = self._scenario.getCosts()
+		if batch_size is None:
+			batch_size = self.GREEDY_BATCH_SIZE if isinstance(costs, np.ndarray) else self.GREEDY_VIEW_BATCH_SIZE
 		ncities = len(cities)
-		best_cost = math.inf
-		count = 0
 		results = {}
-		foundTour = False
-		best_route = []
 		start_time = time.time()
-		
-		
-		#Run greedy ncities time starting with new city each time and take best 
-		#Each iteration is O(n^2)
-		for start_city in cities:
-			total_cost = 0
-			current_city = start_city
-			route = []
-			remaining_cites = cities.copy()
-			remaining_cites.remove(start_city)
-			route.append(start_city)
-
-
-			#Travel from city to city completing a path - O(n)
-			while remaining_cites:
-				#Initialize least cost to inifinity
-				least_cost = math.inf
-				least_cost_city = None
-				#Check all path options for current city - O(n)
-				for option in remaining_cites:
-					cost = current_city.costTo(option)
-					if cost < least_cost:
-						least_cost = cost
-						least_cost_city = option
-				#Check if route could not be completed and update current city
-				if least_cost != math.inf:
-					remaining_cites.remove(least_cost_city)
-					route.append(least_cost_city)
-					total_cost = total_cost + least_cost
-					current_city = least_cost_city
-				else:
-					total_cost = math.inf
-					remaining_cites = []
-			
-			#Check if route could not be completed and update cost
-			if total_cost != math.inf:
-				total_cost = total_cost + route[ncities-1].costTo(start_city)
-			count = count + 1
-			#Check for best route so far and update
-			if total_cost < best_cost:
-				best_cost = total_cost
-				best_route = route
-		
-		#Check if we found a complete route
-		if best_cost != math.inf:
-			foundTour = True
+		deadline = start_time + time_allowance
+
+		# Each city's cheapest destinations, cheapest first, ties to the lowest index
+		nearest = nearestCandidates(costs, self.GREEDY_CANDIDATES[-1])
+
+		#Run greedy ncities times starting with new city each time and take best
+		#Starts are advanced batch_size at a time; each batch is O(batch_size * n) per step
+		if workers > 1:
+			best_cost, best_route, count = parallelGreedy(costs, nearest, self.GREEDY_CANDIDATES, \
+														  batch_size, deadline, workers)
+		else:
+			best_cost, best_route, count = bestGreedyTour(costs, nearest, self.GREEDY_CANDIDATES, \
+														  range(0, ncities, batch_size), batch_size, deadline)
 
 		end_time = time.time()
 
 		#Create return variables
-		bssf = TSPSolution(best_route)
+		foundTour = best_cost != math.inf
+		bssf = TSPSolution([cities[i] for i in best_route]) if foundTour else None
 		results['cost'] = bssf.cost if foundTour else math.inf
 		results['time'] = end_time - start_time
 		results['count'] = count
@@ -152,7 +172,60 @@ class TSPSolver:
 		results['max'] = None
 		results['total'] = None
 		results['pruned'] = None
-			
+
+		return results
+
+
+	''' <summary>
+		Construction heuristics for large instances (see TSPConstruct).  Each builds
+		one tour and returns it in the same results dictionary as greedy; none of them
+		stops early, since a partial tour is of no use, so time_allowance is ignored.
+		greedyEdge joins the cheapest edges first (GREEDY_EDGE_CANDIDATES per city),
+		cheapestInsertion and farthestInsertion grow a tour one city at a time, and
+		spaceFillingCurve visits the cities in Hilbert curve order.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of the tour,
+		time spent to build it, the number of tours built (1), the tour (None if it
+		has to use a missing edge), and three null values for fields not used for
+		these algorithms</returns>
+	'''
+
+	def greedyEdge( self, time_allowance=60.0 ):
+		start_time = time.time()
+		costs = self._scenario.getCosts()
+		route = greedyEdgeTour(costs, nearestCandidates(costs, self.GREEDY_EDGE_CANDIDATES))
+		return self.constructionResults(route, start_time)
+
+	def cheapestInsertion( self, time_allowance=60.0 ):
+		start_time = time.time()
+		route = insertionTour(self._scenario.getCosts(), 'cheapest')
+		return self.constructionResults(route, start_time)
+
+	def farthestInsertion( self, time_allowance=60.0 ):
+		start_time = time.time()
+		route = insertionTour(self._scenario.getCosts(), 'farthest')
+		return self.constructionResults(route, start_time)
+
+	def spaceFillingCurve( self, time_allowance=60.0 ):
+		start_time = time.time()
+		xs, ys = self._scenario.getCoordinates()
+		route = hilbertTour(self._scenario.getCosts(), xs, ys)
+		return self.constructionResults(route, start_time)
+
+	# Wraps a constructed route of city indices in the usual results dictionary
+	def constructionResults( self, route, start_time ):
+		cities = self._scenario.getCities()
+		bssf = TSPSolution([cities[i] for i in route])
+		foundTour = bssf.cost < np.inf
+
+		results = {}
+		results['cost'] = bssf.cost if foundTour else math.inf
+		results['time'] = time.time() - start_time
+		results['count'] = 1
+		results['soln'] = bssf if foundTour else None
+		results['max'] = None
+		results['total'] = None
+		results['pruned'] = None
 		return results
 
 	
@@ -168,167 +241,261 @@ class TSPSolver:
 			print()
 		print()
 	
-	# Uses the list of cities to generate a 2d matrix of travel costs
-	# Iterates over each city,city pair once, creating an N^2 matrix
-	# TIME: 2 * N^2 = N^2 (the 2 comes from initializing the array)
+	# Copies the scenario's precomputed cost matrix into a 2d array of travel costs
+	# The diagonal is already infinity since self-edges never exist
+	# Only called for up to Scenario.DENSE_COST_CITIES cities, where getCosts is the matrix
+	# TIME: N^2
 	# SPACE: N^2
 	def generateMatrix(self, cityList, cNum):
-		cities = [[float('inf') for i in range(cNum)] for j in range(cNum)]
-
-		for row in range(cNum):
-			for col in range(cNum):
-				if row == col: continue
-				cities[row][col] = cityList[row].costTo(cityList[col])
+		cities = self._scenario.getCosts().copy()
 
 		# self.printMatrix(cities)
 		return cities
 
-	# Takes in a city matrix and calculates the lower bound value
-	# Returns the lower bound cost and the update city matrix
-	# Iterates over each row of the grid twice, then each col twice
-	# TIME: 4 * N^2 = N^2
-	# SPACE: Works in place, uses the pre-existing N^2 matrix
-	def calcLowerBound(self, mat):
-		minCost = 0
-		for row in range( len(mat) ):
-			low = float('inf')
-			for col in range( len(mat[row]) ):
-				low = min(low, mat[row][col])
-			
-			if low == float('inf'): continue
-			
-			minCost += low
-			for col in range( len(mat[row]) ):
-				mat[row][col] -= low
-		
-		for col in range( len(mat) ):
-			low = float('inf')
-			for row in range( len(mat[row]) ):
-				low = min(low, mat[row][col])
-			
-			if low == float('inf'): continue
-
-			minCost += low
-			for row in range( len(mat[row]) ):
-				mat[row][col] -= low
-
-		return minCost, mat
-
-	# Calculates the additional costs related to travelling
-	# from the source city to destination city in given matrix
-	# Iterates across N long row, then down N long column
-	# Calls the N^2 time lower bound update
-	# TIME: N^2 because of bound update
-	# SPACE: Works in place
-	def calcChild(self, cities, source, dest):
-		# print("calcChild", source, "->", dest)
-		if cities[source][dest] == float('inf'): return float('inf'), None
-
-		travelCost = cities[source][dest]
-		for row in range( len(cities) ):
-			cities[row][dest] = float('inf')
-		for col in range( len(cities) ):
-			cities[source][col] = float('inf')
-
-		cities[dest][source] = float('inf')
-		bound, cities = self.calcLowerBound(cities) # N^2 time
-
-		return travelCost + bound, cities
-	
 	''' <summary>
 		This is the entry point for the branch-and-bound algorithm that you will implement
+		bound picks the lower bound from TSPBounds.BOUNDS: 'reduction' (row/column
+		reduction), 'assignment' or 'arborescence' (Lagrangian 1-arborescence).
+		strategy picks the search order from bbQueue.STRATEGIES: 'weighted' (the
+		original depth-scaled bound), 'best', 'depth' or 'hybrid'.
+		The queue held in memory is capped at max_queue states and at memory_limit
+		bytes (BB_MEMORY_LIMIT by default).  When a cap is reached the states with
+		the highest lower bounds are dropped and counted as pruned, so the result may
+		no longer be optimal; with spill=True they are written to disk instead.
+		With workers > 1 the first BB_SPLIT_DEPTH levels are expanded here and the
+		rest of the search is spread over that many processes (see TSPParallel),
+		each with an equal share of memory_limit; spilling is not used there.
+		With held_karp=True, instances of up to BB_HELD_KARP_CITIES cities whose
+		Held-Karp table fits in memory_limit are solved by heldKarp instead of
+		being searched, so the queue statistics of such a run are all None.
+		Past Scenario.DENSE_COST_CITIES cities no cost matrix is built and the
+		search is skipped, since bounding even the root's children would take
+		N^3 time; the seed tour is returned with no states generated.
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution, 
 		time spent to find best solution, total number solutions found during search (does
 		not include the initial BSSF), the best solution found, and three more ints: 
-		max queue size, total number of states created, and number of pruned states.</returns> 
+		max queue size (in memory), total number of states created, and number of pruned states.
+		Also includes the bound and strategy used, the bound's value at the root, the
+		number of states spilled to disk and the time the search found its first tour;
+		with workers > 1, the number of workers that died or hung (lostWorkers).</returns> 
 	'''
 		
-	def branchAndBound( self, time_allowance=60.0 ):
+	def branchAndBound( self, time_allowance=60.0, memory_limit=None, bound='reduction', \
+						strategy='weighted', max_queue=None, spill=False, workers=1, held_karp=False ):
+		if memory_limit is None:
+			memory_limit = self.BB_MEMORY_LIMIT
 		results = {}
 		cities = self._scenario.getCities()
 		ncities = len(cities)
 		bssf = None
 		start_time = time.time()
 
+		# Small instances are quicker to solve outright than to search, however bad
+		# If Held-Karp runs out of time, the search gets what is left of the allowance
+		if held_karp and ncities <= self.BB_HELD_KARP_CITIES:
+			exact = self.heldKarp(time_allowance, memory_limit, fallback=False)
+			if exact['soln'] is not None:
+				exact['bound'] = bound
+				exact['strategy'] = strategy
+				exact['rootBound'] = None
+				exact['spilled'] = 0
+				exact['firstSolutionTime'] = exact['time']
+				return exact
+
 		_statesGenerated = 0
 		_statesPruned = 0
 		_bssfUpdates = 0
 		_queueMaxLength = 0
 
-		# Worst Case N^N if it tries every random shape
-		# Realistic: ~N time to populate a list
-		# Space: N long array is discarded
-		bssfCost = self.defaultRandomTour()['cost']
-		# print("Random Cost:", bssfCost)
+		# Seed the BSSF with a greedy tour polished by local search so pruning is tight
+		# from the first state; its time comes out of the overall allowance
+		# Greedy is N^3 in the worst case, local search is capped at BB_SEED_TIME_FRACTION of the allowance
+		seedTime = time_allowance * self.BB_SEED_TIME_FRACTION
+		bssf, _ = self.improveTour(self.constructTour(seedTime), start_time + seedTime)
+		if bssf.cost == np.inf:
+			bssf = None
+		bssfCost = bssf.cost if bssf else np.inf
+		# print("Seed Cost:", bssfCost)
+
+		if not isinstance(self._scenario.getCosts(), np.ndarray):
+			results['time'] = time.time() - start_time
+			results['soln'] = bssf
+			results['cost'] = bssfCost
+			results['count'] = 0
+			results['max'] = 0
+			results['total'] = 0
+			results['pruned'] = 0
+			results['bound'] = bound
+			results['strategy'] = strategy
+			results['rootBound'] = None
+			results['spilled'] = 0
+			results['firstSolutionTime'] = None
+			return results
 
 		# Generates a N^2 matrix using in N^2 time
-		cityMat = self.generateMatrix(cities, ncities)
-		minCost, cityMat = self.calcLowerBound(cityMat)
-
-		q = []
-		route = [cities[0]]
-		# self.printMatrix(cityMat)
+		# States only keep their bound's data; e.g. the reduction bound rebuilds
+		# a state's reduced matrix when it is expanded
+		costMat = self.generateMatrix(cities, ncities)
+		lowerBound = BOUNDS[bound](costMat)
+		deadline = start_time + time_allowance
+		minCost, rootData = lowerBound.root(bssfCost, deadline)
+		stateBytes = self.BB_STATE_OVERHEAD_BYTES + lowerBound.stateBytes(ncities)
+		maxStates = memory_limit // stateBytes
+		if max_queue is not None:
+			maxStates = min(maxStates, max_queue)
+
+		q = bbQueue(strategy, max_size=maxStates, spill=spill, trim_fraction=self.BB_TRIM_FRACTION)
+		firstSolutionTime = None
+
+		if workers > 1:
+			root = bbState(None, cities[0]._index, rootData, minCost)
+			return self.parallelBranchAndBound(root, lowerBound, bssf, maxStates // workers, \
+											   strategy, workers, start_time, time_allowance, results)
 
 		# According to slides, heap push is O(Log N)
-		heapq.heappush(q, bbState(route, 0, cityMat, minCost))
+		q.push(bbState(None, cities[0]._index, rootData, minCost))
 
 		while q and (time.time() - start_time < time_allowance):
-			_queueMaxLength = max(_queueMaxLength, len(q))
+			_queueMaxLength = max(_queueMaxLength, q.inMemory())
 
 			# According to slides, heap pop is O(Log N)
-			state = heapq.heappop(q)
+			state = q.pop()
 
 			if state.lowerBound > bssfCost: 
 				_statesPruned += 1
 				continue
 
-			if len(state.route) == ncities:
-				bssf = TSPSolution(state.route)
-				bssfCost = state.lowerBound
-				_bssfUpdates += 1
+			if state.depth == ncities - 1:
+				# The bound does not always see a missing edge back to the start,
+				# so cost the finished tour itself
+				solution = TSPSolution([cities[i] for i in state.getRoute()])
+				if firstSolutionTime is None:
+					firstSolutionTime = time.time() - start_time
+				q.foundSolution()
+				if solution.cost < bssfCost:
+					bssf = solution
+					bssfCost = solution.cost
+					_bssfUpdates += 1
 				continue
 
 			# Worst Case: N-1 Cities to expand, Log N average
-			# Worse Case: N-1 Matricies to generate, Log N average
-			# Overall Log N * N^2 operations in time and space
+			# Each child's bound costs N^2 (reduction) up to N^3 (assignment, arborescence)
 			# In practice, value will be smaller due to timeout and pruning
-			for destination in cities:
-				if destination not in state.route:
-					dest = destination._index
-					_statesGenerated += 1
-					# print("Generate Child:", dest)
-					childRoute = state.route.copy() # N time and space
-					childRoute.append(cities[dest]) 
-					childCities = deepcopy(state.cityMatrix) # N^2 Time and Space
-
-					# calcChild is an N^2 Time, 1 Space function
-					additionalCost, childCities = self.calcChild(childCities, childRoute[-2]._index, dest)
-					childCost = state.lowerBound + additionalCost
-					if childCost < bssfCost:
-						# print("Inject Child:", dest)
-						#Push is O(Log N)
-						heapq.heappush(q, bbState(childRoute, state.depth+1, childCities, childCost))
-					else:
-						_statesPruned += 1
+			for dest, childCost, childData in lowerBound.children(state, bssfCost, deadline):
+				_statesGenerated += 1
+				if childCost < bssfCost:
+					#Push is O(Log N)
+					q.push(bbState(state, dest, childData, childCost))
+				else:
+					_statesPruned += 1
+
+			# Children carry their own bound data, so an expanded state
+			# only needs to stay alive as a link in its children's routes
+			state.boundData = None
 
-		_statesPruned += len(q)
+		_statesPruned += len(q) + q.dropped
 
 		end_time = time.time()
 		results['time'] = end_time - start_time
 		results['soln'] = bssf
-		results['cost'] = bssfCost
+		results['cost'] = bssf.cost if bssf else math.inf
 		results['count'] = _bssfUpdates
 		results['max'] = _queueMaxLength
 		results['total'] = _statesGenerated
 		results['pruned'] = _statesPruned
+		results['bound'] = bound
+		results['strategy'] = strategy
+		results['rootBound'] = minCost
+		results['spilled'] = q.spilled
+		results['firstSolutionTime'] = firstSolutionTime
 		# print("Done")
 		return results
 
+	# The workers > 1 half of branchAndBound: expands the root's first BB_SPLIT_DEPTH
+	# levels, then searches the states left under them in parallel
+	# Statistics are combined over all workers, 'max' being the sum of their largest queues
+	def parallelBranchAndBound( self, root, lowerBound, bssf, maxStates, strategy, workers, \
+								start_time, time_allowance, results ):
+		cities = self._scenario.getCities()
+		bssfCost = bssf.cost if bssf else np.inf
+		_statesGenerated = 0
+		_statesPruned = 0
+
+		deadline = start_time + time_allowance
+		frontier = [root]
+		for level in range(min(self.BB_SPLIT_DEPTH, len(cities) - 1)):
+			children = []
+			for state in frontier:
+				if time.time() > deadline:
+					break
+				for dest, childCost, childData in lowerBound.children(state, bssfCost, deadline):
+					_statesGenerated += 1
+					if childCost < bssfCost:
+						children.append(bbState(state, dest, childData, childCost))
+					else:
+						_statesPruned += 1
+				state.boundData = None
+			frontier = children
+
+		search = parallelSearch(self._scenario.getCosts(), lowerBound.name, strategy, maxStates, \
+								frontier, bssfCost, deadline, workers)
+		if search['route'] is not None:
+			bssf = TSPSolution([cities[i] for i in search['route']])
+
+		end_time = time.time()
+		results['time'] = end_time - start_time
+		results['soln'] = bssf
+		results['cost'] = bssf.cost if bssf else math.inf
+		results['count'] = search['count']
+		results['max'] = max(search['max'], len(frontier))
+		results['total'] = _statesGenerated + search['total']
+		results['pruned'] = _statesPruned + search['pruned']
+		results['bound'] = lowerBound.name
+		results['strategy'] = strategy
+		results['rootBound'] = root.lowerBound
+		results['spilled'] = 0
+		results['firstSolutionTime'] = None
+		results['workers'] = workers
+		results['lostWorkers'] = search['lost']
+		return results
+
+	''' <summary>
+		Runs branch-and-bound once with each search strategy in bbQueue.STRATEGIES on
+		the current scenario, so queue size can be weighed against time to first tour.
+		Extra keyword arguments (bound, max_queue, spill, ...) go to every run.
+		</summary>
+		<returns>dictionary from strategy name to that run's results dictionary</returns>
+	'''
+	def compareStrategies( self, time_allowance=60.0, **options ):
+		return { name: self.branchAndBound(time_allowance, strategy=name, **options) for name in bbQueue.STRATEGIES }
+
+	''' <summary>
+		Runs branch-and-bound once with each lower bound in TSPBounds.BOUNDS on the
+		current scenario, to see how much each one cuts the search.
+		</summary>
+		<returns>dictionary from bound name to that run's results dictionary, with
+		'totalVsReduction' and 'prunedVsReduction' giving the run's generated and
+		pruned states as a fraction of the reduction bound's</returns>
+	'''
+	def compareBounds( self, time_allowance=60.0 ):
+		runs = { name: self.branchAndBound(time_allowance, bound=name) for name in BOUNDS }
+		baseline = runs['reduction']
+		for results in runs.values():
+			results['totalVsReduction'] = results['total'] / max(baseline['total'], 1)
+			results['prunedVsReduction'] = results['pruned'] / max(baseline['pruned'], 1)
+		return runs
+
 
 
 	''' <summary>
 		This is the entry point for the algorithm you'll write for your group project.
+		With reversals=False the local search only uses moves that keep the tour's
+		orientation (Or-opt and 3-opt segment exchange), leaving out 2-opt and
+		reversed Or-opt insertions.  If the local search improves the starting tour,
+		callback is called with the new solution.  With held_karp=True, instances
+		of up to FANCY_HELD_KARP_CITIES cities are solved exactly by heldKarp
+		instead.
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution, 
 		time spent to find best solution, total number of solutions found during search, the 
@@ -336,43 +503,31 @@ class TSPSolver:
 		algorithm</returns> 
 	'''
 	
-	def fancy( self,time_allowance=60.0 ):
-		# Use greedy algorithm to find a initial tour
-		greedy_solution = self.greedy(time_allowance)
-		self.bssf = greedy_solution['soln']
+	def fancy( self,time_allowance=60.0, reversals=True, callback=None, held_karp=False ):
+		start_time = time.time()
 
-		results = {}
-		self.num_cities = len(self._scenario.getCities())
-		self.start_time = time.time()
-		self.new_solutions_found = 0
-		self.time_allowance = time_allowance
-
-		# Define number of cities to swap in a route
-		# As k increases, the solution optimality and time complexity both increase
-		if self.num_cities <= 9 and self.num_cities >= 5:
-			k = self.num_cities - 3
-		elif self.num_cities <= 15:
-			k = 5
-		elif self.num_cities <= 25:
-			k = 4
-		elif self.num_cities <= 75:
-			k = 3
-		else:
-			k = 2
+		if held_karp and len(self._scenario.getCities()) <= self.FANCY_HELD_KARP_CITIES:
+			results = self.heldKarp(time_allowance, fallback=False)
+			if results['soln'] is not None:
+				if callback is not None:
+					callback( results['soln'] )
+				return results
+
+		# Use greedy algorithm to find a initial tour, leaving most of the time for local search
+		bssf = self.constructTour(time_allowance * self.FANCY_GREEDY_TIME_FRACTION)
 
-		self.improved = True
-		while self.improved:
-			self.improved = False
-			for i in range(self.num_cities):
-				# Check all combinations of k cities swaped to see if route has improved
-				self.kOptSwap(self.bssf.route, k, i)
+		# Improve the tour with 2-opt, Or-opt and 3-opt moves into each city's nearest
+		# neighbors, scoring each move from the edges it changes instead of recosting the route
+		bssf, improvements = self.improveTour(bssf, start_time + time_allowance, reversals)
+		if improvements > 0 and callback is not None:
+			callback( bssf )
 
-						
 		end_time = time.time()
-		results['cost'] = self.bssf.cost
-		results['time'] = end_time - self.start_time
-		results['count'] = self.new_solutions_found
-		results['soln'] = self.bssf
+		results = {}
+		results['cost'] = bssf.cost
+		results['time'] = end_time - start_time
+		results['count'] = improvements
+		results['soln'] = bssf
 		results['max'] = 0
 		results['total'] = 0
 		results['pruned'] = 0
@@ -380,33 +535,244 @@ class TSPSolver:
 
 
 
-	def kOptSwap(self, route, k, i):
-		# Check time allowance
-		if time.time() - self.start_time > self.time_allowance:
-			return
-
-		if k > 1:
-			# Make new routes by swapping different combinations 2 cities
-			for j in range(self.num_cities):
-				new_route = self.twoOptSwap(route, i, j)
-				# Keep swaping cities in route until k cities have been swaped 
-				self.kOptSwap(new_route, k - 1, j)
-
-		else :
-			# Check if solution is better than best solution so far, if so update
-			new_solution = TSPSolution(route)
-			if new_solution.cost < self.bssf.cost:
-				self.improved = True
-				self.bssf = new_solution
-				self.new_solutions_found += 1
-				print('Updated BSSF: ' + str(self.bssf.cost))
-			
-	
-	# Swap 2 cities in a route
-	def twoOptSwap(self, route, i, k):
-		a = route[0:i]
-		b = route[i:k+1]
-		b.reverse()
-		c = route[k+1:]
-		new_route = a + b + c
-		return new_route
+	''' <summary>
+		Exact solver: Held-Karp dynamic programming over every subset of the cities
+		other than the first (see TSPHeldKarp), in O(2^n n^2) time.  If its table
+		would take more than memory_limit bytes, it falls back to fancy, or with
+		fallback=False returns no solution.  It also returns no solution if the
+		time allowance runs out first.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of the optimal
+		solution, time spent to find it, 1 if a tour was found, the optimal solution,
+		and three null values for fields not used for this algorithm</returns>
+	'''
+
+	def heldKarp( self, time_allowance=60.0, memory_limit=None, fallback=True ):
+		if memory_limit is None:
+			memory_limit = self.HK_MEMORY_LIMIT
+		start_time = time.time()
+		cities = self._scenario.getCities()
+		costs = self._scenario.getCosts()
+		rest = list(range(1, len(cities)))
+
+		# Past Scenario.DENSE_COST_CITIES (a CostView) the table could never fit
+		bssf = None
+		if not isinstance(costs, np.ndarray) or \
+		   heldKarpBytes(len(rest), tableType(costs, len(rest))) > memory_limit:
+			if fallback:
+				return self.fancy(time_allowance)
+		else:
+			found = heldKarpPath(costs, 0, 0, rest, start_time + time_allowance)
+			if found is not None and found[1] is not None:
+				bssf = TSPSolution([cities[i] for i in [0] + found[1]])
+
+		results = {}
+		results['cost'] = bssf.cost if bssf else math.inf
+		results['time'] = time.time() - start_time
+		results['count'] = 1 if bssf else 0
+		results['soln'] = bssf
+		results['max'] = None
+		results['total'] = None
+		results['pruned'] = None
+		return results
+
+
+
+	''' <summary>
+		Anytime version of fancy: starts from the same tour, then runs iterated
+		local search (LocalSearch.iterate) with double-bridge kicks and
+		segment-random restarts, using the whole time allowance.  Every new best
+		solution is passed to callback as soon as it is found, if one is given.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of best solution,
+		time spent, number of best solutions found, the best solution found (None if it
+		has to use a missing edge), and three null values for fields not used for this
+		algorithm.  bestFoundTime is the time at which the best solution was found.</returns>
+	'''
+
+	def iteratedLocalSearch( self, time_allowance=60.0, reversals=True, callback=None ):
+		start_time = time.time()
+		bssf = self.constructTour(time_allowance * self.FANCY_GREEDY_TIME_FRACTION)
+
+		search = LocalSearch( self._scenario.getCosts(), bssf.indices, \
+							  self._scenario.neighborLists( self.NEIGHBORS ), reversals )
+		return self.anytimeResults( search.iterate( start_time + time_allowance ), bssf, start_time, callback )
+
+
+
+	''' <summary>
+		Simulated annealing: starts from the same tour as fancy, then proposes
+		batches of random 2-opt and Or-opt moves into each city's NEIGHBORS
+		candidate neighbors, scores each batch at once with numpy and accepts moves
+		by the Metropolis rule (see TSPAnneal.Annealer).  schedule is 'exponential'
+		or 'linear' cooling, and reheats extra cooling runs share the time allowance,
+		each starting from the best tour so far.  Every new best solution is passed
+		to callback, if one is given.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of best solution,
+		time spent, number of best solutions found, the best solution found (None if it
+		has to use a missing edge), the number of moves proposed and the number rejected.  bestFoundTime is the time at which
+		the best solution was found.</returns>
+	'''
+
+	def simulatedAnnealing( self, time_allowance=60.0, schedule='exponential', reheats=None, \
+							batch_size=None, callback=None ):
+		if reheats is None:
+			reheats = self.SA_REHEATS
+		if batch_size is None:
+			batch_size = self.SA_BATCH_SIZE
+		start_time = time.time()
+		bssf = self.constructTour(time_allowance * self.FANCY_GREEDY_TIME_FRACTION)
+
+		annealer = Annealer( self._scenario.getCosts(), bssf.indices, \
+							 self._scenario.neighborLists( self.NEIGHBORS ) )
+		results = self.anytimeResults( annealer.anneal( start_time + time_allowance, schedule, reheats, batch_size ), \
+									   bssf, start_time, callback )
+		results['total'] = annealer.proposed
+		results['pruned'] = annealer.proposed - annealer.accepted
+		return results
+
+
+
+	''' <summary>
+		Genetic solver: starts from the same tour as fancy and evolves a population
+		of locally optimal tours by order crossover, random 2-opt mutation and
+		tournament selection (see TSPGenetic.GeneticSearch).  Offspring are bred and
+		polished by a pool of worker processes, one per CPU but no more than the
+		population, unless workers is given; workers=1 keeps everything in this
+		process, which is also the default for populations under
+		GA_PARALLEL_POPULATION and when run from the GUI.  Every new best solution
+		is passed to callback, if one is given.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of best solution,
+		time spent, number of best solutions found, the best solution found (None if it
+		has to use a missing edge), the number of offspring bred and the number that did
+		not make it into the population.
+		bestFoundTime is the time at which the best solution was found.</returns>
+	'''
+
+	def genetic( self, time_allowance=60.0, population=None, workers=None, reversals=True, \
+				 callback=None ):
+		if population is None:
+			population = self.GA_POPULATION
+		if workers is None:
+			# Too few offspring per generation to pay for the processes, and the GUI
+			# is better off not forking its Qt state into them
+			if population < self.GA_PARALLEL_POPULATION or self._view is not None:
+				workers = 1
+			else:
+				workers = min( os.cpu_count() or 1, population )
+		start_time = time.time()
+		bssf = self.constructTour(time_allowance * self.FANCY_GREEDY_TIME_FRACTION)
+
+		search = GeneticSearch( self._scenario.getCosts(), bssf.indices, \
+								self._scenario.neighborLists( self.NEIGHBORS ), reversals, population, workers )
+		results = self.anytimeResults( search.evolve( start_time + time_allowance ), bssf, start_time, callback )
+		results['total'] = search.offspring
+		results['pruned'] = search.offspring - search.survivors
+		return results
+
+
+
+	''' <summary>
+		Lin-Kernighan style local search: applies variable-depth chains of 2-opt
+		moves (up to LocalSearch.LK_DEPTH deep) together with Or-opt and 3-opt
+		segment moves, all restricted to each city's NEIGHBORS candidate neighbors,
+		until a local optimum or the time allowance.  It descends once, from a
+		farthest insertion tour, which is quicker to build than fancy's greedy tour
+		and leads the chains to a better optimum (past Scenario.DENSE_COST_CITIES,
+		from the space-filling curve tour instead).
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of best solution,
+		time spent to find best solution, number of improving moves applied, the best
+		solution found (None if it has to use a missing edge), and three null values
+		for fields not used for this algorithm</returns>
+	'''
+
+	def linKernighan( self, time_allowance=60.0 ):
+		start_time = time.time()
+		cities = self._scenario.getCities()
+		costs = self._scenario.getCosts()
+		if isinstance(costs, np.ndarray):
+			route = insertionTour( costs, 'farthest' )
+		else:
+			route = hilbertTour( costs, *self._scenario.getCoordinates() )
+
+		search = LocalSearch( costs, route, \
+							  self._scenario.neighborLists( self.NEIGHBORS ), variableDepth=True )
+		search.optimize( start_time + time_allowance )
+		bssf = TSPSolution( [cities[i] for i in search.getTour()] )
+		foundTour = bssf.cost < np.inf
+
+		results = {}
+		results['cost'] = bssf.cost if foundTour else math.inf
+		results['time'] = time.time() - start_time
+		results['count'] = search.improvements
+		results['soln'] = bssf if foundTour else None
+		results['max'] = None
+		results['total'] = None
+		results['pruned'] = None
+		return results
+
+
+
+	# Starting tour for the improvement heuristics: the best greedy tour, or a random
+	# valid tour if greedy cannot complete one; both share the time allowance
+	# If neither finds a tour in time this returns an invalid random tour (infinite
+	# cost), which the local search can still repair since missing edges are just expensive
+	# Past Scenario.DENSE_COST_CITIES it is the space-filling curve tour, which needs no cost matrix
+	def constructTour( self, time_allowance ):
+		start_time = time.time()
+		costs = self._scenario.getCosts()
+		if not isinstance(costs, np.ndarray):
+			cities = self._scenario.getCities()
+			route = hilbertTour(costs, *self._scenario.getCoordinates())
+			return TSPSolution([cities[i] for i in route])
+		bssf = self.greedy(time_allowance)['soln']
+		if bssf is None:
+			bssf = self.defaultRandomTour(max(time_allowance - (time.time() - start_time), 0.0))['soln']
+		if bssf is None:
+			cities = self._scenario.getCities()
+			bssf = TSPSolution([cities[i] for i in np.random.permutation(len(cities))])
+		return bssf
+
+	# Runs an anytime search to its end: tours yields (cost, tour) for each new best
+	# tour, counting a missing edge as a large finite cost, and each one that is a
+	# real tour is passed to callback
+	# Returns the results dictionary for the last (best) tour, starting from bssf,
+	# with soln None and an infinite cost if it still uses a missing edge
+	def anytimeResults( self, tours, bssf, start_time, callback=None ):
+		cities = self._scenario.getCities()
+		count = 0
+		found_time = time.time()
+		for _, tour in tours:
+			bssf = TSPSolution( [cities[i] for i in tour] )
+			count += 1
+			found_time = time.time()
+			if callback is not None and bssf.cost < np.inf:
+				callback( bssf )
+		foundTour = bssf.cost < np.inf
+
+		results = {}
+		results['cost'] = bssf.cost if foundTour else math.inf
+		results['time'] = time.time() - start_time
+		results['count'] = count
+		results['soln'] = bssf if foundTour else None
+		results['max'] = None
+		results['total'] = None
+		results['pruned'] = None
+		results['bestFoundTime'] = found_time - start_time
+		return results
+
+	# Runs the local search engine on a solution until a local optimum or the deadline
+	# Returns the improved solution and the number of improving moves applied
+	# reversals=False limits it to the moves that keep the tour's orientation
+	def improveTour( self, solution, deadline, reversals=True ):
+		cities = self._scenario.getCities()
+		search = LocalSearch( self._scenario.getCosts(), solution.indices, \
+							  self._scenario.neighborLists( self.NEIGHBORS ), reversals )
+		search.optimize( deadline )
+
+		if search.improvements > 0:
+			solution = TSPSolution( [cities[i] for i in search.getTour()] )
+		return solution, search.improvements
@@ -0,0 +1,387 @@
+#!/usr/bin/python3
+
+
+import math
+import numpy as np
+
+
+
+
+''' <summary>
+	A tour stored as a two-level doubly-linked list, so that reversing a path of
+	the tour costs O(sqrt n) instead of O(n).
+
+	The tour is cut into about sqrt(n) segments of consecutive cities.  Each city
+	links to its neighbors inside its segment and has a sequence number that
+	grows along the segment; each segment has a reverse bit and a rank, its place
+	in the list of segments, and the whole tour has a reverse bit of its own.
+	A flip cuts at most two segments so the path is made of whole ones, then
+	reverses the order of those segments and toggles their reverse bits.  A path
+	inside one segment is relinked in place instead.  When the rest of the tour
+	spans fewer segments than the path, the rest is reversed and the tour's
+	reverse bit toggled, which gives the same cycle.  Cuts add segments, so once
+	there are REBUILD_FACTOR times as many as at the start the list is rebuilt.
+
+	Given a cost matrix (finite, e.g. with missing edges replaced by a large
+	stand-in), each city also keeps prefix sums of the edge costs along its
+	segment, walked forwards and backwards, and each segment the cost of its own
+	edges both ways.  Costs up to the start of each segment, in segment order,
+	go stale with every flip and are redone with a few numpy operations over the
+	segments the next time a cost is asked for, after which pathCosts prices any
+	path in O(1).  That is what scoring a reversal needs when costs are
+	asymmetric.  With symmetric=True a reversal leaves the cost of the path's own
+	edges alone, so no sums are kept: each flip prices the two edges it changes
+	to keep the tour's cost up to date, and pathCosts is not available.
+
+	Per-city and per-segment data is kept in flat Python lists indexed by city or
+	segment number, which are quicker than numpy arrays to read one at a time.
+	</summary> '''
+class Tour:
+
+	REBUILD_FACTOR = 2 # Rebuild once cuts have made this many times the starting number of segments
+
+	def __init__( self, order, costs=None, groupSize=None, symmetric=False ):
+		order = [ int(city) for city in order ]
+		self._n = len(order)
+		self._costs = costs
+		self._sums = costs is not None and not symmetric # Whether prefix sums are kept
+		self._groupSize = groupSize or max( 1, math.isqrt(self._n) )
+		self._build( order )
+
+	def __len__( self ):
+		return self._n
+
+	# Lays the cities out in segments of groupSize, in the given order
+	# TIME: N
+	# SPACE: N
+	def _build( self, order ):
+		n, size = self._n, self._groupSize
+		self._next = [0] * n # Next city inside the segment, along its internal order
+		self._prev = [0] * n
+		self._seg = [0] * n
+		self._seq = [0] * n
+		for i, city in enumerate(order):
+			self._next[city] = order[(i + 1) % n]
+			self._prev[city] = order[i - 1]
+			self._seg[city] = i // size
+			self._seq[city] = i
+		self._first = order[::size]
+		self._last = [ order[min(i + size, n) - 1] for i in range(0, n, size) ]
+		count = len(self._first)
+		self._rev = [False] * count
+		self._order = list(range(count))
+		self._rank = list(range(count))
+		self._reversed = False
+		self._maxSegments = self.REBUILD_FACTOR * count
+		self._stale = True
+
+		if self._costs is not None and not self._sums:
+			path = np.array( order, dtype=np.intp )
+			self._total = int( self._costs[path, np.roll(path, -1)].sum() )
+		elif self._costs is not None:
+			path = np.array( order, dtype=np.intp )
+			# Sums along the whole order serve every segment, since only
+			# differences between cities of the same segment are ever taken
+			self._fwd = [0] * n
+			self._bwd = [0] * n
+			ahead = np.cumsum( self._costs[path[:-1], path[1:]] ).tolist()
+			back = np.cumsum( self._costs[path[1:], path[:-1]] ).tolist()
+			for city, f, b in zip(order[1:], ahead, back):
+				self._fwd[city], self._bwd[city] = f, b
+			self._innerFwd = [0] * count
+			self._innerBwd = [0] * count
+			for s in range(count):
+				self._measure( s )
+
+	# Cost of the tour walked forwards, with each edge from a city to the next;
+	# None for a tour made without costs
+	@property
+	def cost( self ):
+		if self._costs is None:
+			return None
+		if not self._sums:
+			return self._total
+		if self._stale:
+			self._sumSegments()
+		return self._rawBack if self._reversed else self._rawAhead
+
+	# The cities in tour order
+	# TIME: N
+	def order( self ):
+		route = []
+		count = len(self._order)
+		for r in (range(count - 1, -1, -1) if self._reversed else range(count)):
+			s = self._order[r]
+			if self._rev[s] == self._reversed:
+				city, end, links = self._first[s], self._last[s], self._next
+			else:
+				city, end, links = self._last[s], self._first[s], self._prev
+			route.append( city )
+			while city != end:
+				city = links[city]
+				route.append( city )
+		return route
+
+	def next( self, city ):
+		return self._step( city, not self._reversed )
+
+	def prev( self, city ):
+		return self._step( city, self._reversed )
+
+	# True if walking forward along the tour from a reaches b no later than c
+	def between( self, a, b, c ):
+		if self._reversed:
+			a, c = c, a
+		n, seg, seq, rank, rev = self._n, self._seg, self._seq, self._rank, self._rev
+		s = seg[a]
+		ka = rank[s] * n + (n - 1 - seq[a] if rev[s] else seq[a])
+		s = seg[b]
+		kb = rank[s] * n + (n - 1 - seq[b] if rev[s] else seq[b])
+		s = seg[c]
+		kc = rank[s] * n + (n - 1 - seq[c] if rev[s] else seq[c])
+		if ka <= kc:
+			return ka <= kb <= kc
+		return kb >= ka or kb <= kc
+
+	''' <summary>
+		Reverses the path a -> ... -> b of the tour.
+		</summary> '''
+	# TIME: sqrt(N)
+	def flip( self, a, b ):
+		self._stale = True
+		if self._costs is not None and not self._sums:
+			before, after = self.prev( a ), self.next( b )
+			if after != a:
+				C = self._costs
+				self._total += int( C[before, b] + C[a, after] - C[before, a] - C[b, after] )
+		if self._reversed:
+			a, b = b, a
+		self._rawFlip( a, b )
+		if len(self._order) > self._maxSegments:
+			self._build( self.order() )
+
+	''' <summary>
+		Costs of the path a -> ... -> b, walked forwards and walked backwards.
+		</summary>
+		<returns>(forward cost, backward cost)</returns> '''
+	# TIME: 1, plus sqrt(N) for the first call after a flip
+	def pathCosts( self, a, b ):
+		if self._reversed:
+			back, ahead = self._rawPathCosts( b, a )
+			return ahead, back
+		return self._rawPathCosts( a, b )
+
+
+
+	# The rest of this class works in raw order: the tour as it would be with its
+	# reverse bit clear, visiting segments by rank and each along its internal
+	# order unless its own reverse bit is set
+
+	# The city after 'city' in raw order (ahead=True) or before it (ahead=False)
+	def _step( self, city, ahead ):
+		s = self._seg[city]
+		if self._rev[s] != ahead:
+			if city != self._last[s]:
+				return self._next[city]
+		elif city != self._first[s]:
+			return self._prev[city]
+		t = self._order[(self._rank[s] + (1 if ahead else -1)) % len(self._order)]
+		return self._first[t] if self._rev[t] != ahead else self._last[t]
+
+	# Position of a city in raw order, comparable between any two cities
+	def _key( self, city ):
+		s = self._seg[city]
+		seq = self._seq[city]
+		return self._rank[s] * self._n + (self._n - 1 - seq if self._rev[s] else seq)
+
+	def _rawFirst( self, s ):
+		return self._last[s] if self._rev[s] else self._first[s]
+
+	def _rawLast( self, s ):
+		return self._first[s] if self._rev[s] else self._last[s]
+
+	# Number of segments the raw path x -> ... -> y touches, one more than
+	# there are segments if it leaves x's segment and comes back into it
+	def _segmentsOn( self, x, y ):
+		sx, sy = self._seg[x], self._seg[y]
+		if sx != sy:
+			return (self._rank[sy] - self._rank[sx]) % len(self._order) + 1
+		return 1 if self._key(x) <= self._key(y) else len(self._order) + 1
+
+	def _rawFlip( self, x, y ):
+		after, before = self._step( y, True ), self._step( x, False )
+		if after == x:
+			# The path is the whole tour
+			self._reversed = not self._reversed
+		elif self._segmentsOn( after, before ) < self._segmentsOn( x, y ):
+			self._reversePath( after, before )
+			self._reversed = not self._reversed
+		else:
+			self._reversePath( x, y )
+
+	# Reverses the raw path x -> ... -> y, which does not come back into x's segment
+	def _reversePath( self, x, y ):
+		s = self._seg[x]
+		if s == self._seg[y]:
+			if self._rev[s]:
+				x, y = y, x
+			self._reverseInside( s, x, y )
+			return
+
+		# Cut so that x starts its segment and y ends its segment in raw order
+		if self._rev[s]:
+			if x != self._last[s]:
+				self._split( s, x )
+		elif x != self._first[s]:
+			self._split( s, self._prev[x] )
+		s = self._seg[y]
+		if self._rev[s]:
+			if y != self._first[s]:
+				self._split( s, self._prev[y] )
+		elif y != self._last[s]:
+			self._split( s, y )
+
+		count = len(self._order)
+		start = self._rank[self._seg[x]]
+		run = [ self._order[(start + k) % count] for k in range((self._rank[self._seg[y]] - start) % count + 1) ]
+		for k, t in enumerate(reversed(run)):
+			at = (start + k) % count
+			self._order[at] = t
+			self._rank[t] = at
+			self._rev[t] = not self._rev[t]
+
+	# Reverses the cities u -> ... -> v of segment s, u before v in its internal order
+	# TIME: size of the segment
+	def _reverseInside( self, s, u, v ):
+		cities = [u]
+		while cities[-1] != v:
+			cities.append( self._next[cities[-1]] )
+		before = None if u == self._first[s] else self._prev[u]
+		after = None if v == self._last[s] else self._next[v]
+
+		seqs = [ self._seq[city] for city in cities ]
+		cities.reverse()
+		for city, seq in zip(cities, seqs):
+			self._seq[city] = seq
+		for a, b in zip(cities, cities[1:]):
+			self._next[a], self._prev[b] = b, a
+		if before is None:
+			self._first[s] = v
+		else:
+			self._next[before], self._prev[v] = v, before
+		if after is None:
+			self._last[s] = u
+		else:
+			self._next[u], self._prev[after] = after, u
+
+		if self._sums:
+			self._resum( s, v if before is None else before )
+
+	# Recomputes the prefix sums of segment s from 'city' to the segment's end
+	def _resum( self, s, city ):
+		cities = [city]
+		while cities[-1] != self._last[s]:
+			cities.append( self._next[cities[-1]] )
+		path = np.array( cities, dtype=np.intp )
+		ahead = np.cumsum( self._costs[path[:-1], path[1:]] ) + self._fwd[city]
+		back = np.cumsum( self._costs[path[1:], path[:-1]] ) + self._bwd[city]
+		for city, f, b in zip(cities[1:], ahead.tolist(), back.tolist()):
+			self._fwd[city], self._bwd[city] = f, b
+		self._measure( s )
+
+	# Records the cost of segment s's own edges, along its internal order and against it
+	def _measure( self, s ):
+		first, last = self._first[s], self._last[s]
+		self._innerFwd[s] = self._fwd[last] - self._fwd[first]
+		self._innerBwd[s] = self._bwd[last] - self._bwd[first]
+
+	# Cuts segment s after city u (in internal order), moving the shorter side to a new segment
+	# TIME: size of the segment, plus the number of segments to rerank
+	def _split( self, s, u ):
+		v = self._next[u]
+		# Walk out from the cut both ways at once to find the shorter side
+		left, right = u, v
+		while left != self._first[s] and right != self._last[s]:
+			left, right = self._prev[left], self._next[right]
+
+		t = len(self._first)
+		if left == self._first[s]:
+			start, end = self._first[s], u
+			self._first[s] = v
+			after = self._rev[s]
+		else:
+			start, end = v, self._last[s]
+			self._last[s] = u
+			after = not self._rev[s]
+		self._first.append( start )
+		self._last.append( end )
+		self._rev.append( self._rev[s] )
+		if self._sums:
+			self._innerFwd.append( 0 )
+			self._innerBwd.append( 0 )
+			self._measure( s )
+			self._measure( t )
+
+		city = start
+		self._seg[city] = t
+		while city != end:
+			city = self._next[city]
+			self._seg[city] = t
+
+		at = self._rank[s] + (1 if after else 0)
+		self._order.insert( at, t )
+		self._rank.append( at )
+		for r in range( at + 1, len(self._order) ):
+			self._rank[self._order[r]] = r
+
+	# Costs of the raw path x -> ... -> y, forwards and backwards
+	def _rawPathCosts( self, x, y ):
+		s = self._seg[x]
+		in_order = self._key(x) <= self._key(y)
+		if s == self._seg[y] and in_order:
+			return self._inside( s, x, y )
+		if self._stale:
+			self._sumSegments()
+		fx, bx = self._prefix( x )
+		fy, by = self._prefix( y )
+		if in_order:
+			return fy - fx, by - bx
+		# The path wraps past the end of raw order
+		return self._rawAhead - fx + fy, self._rawBack - bx + by
+
+	# Costs of the raw path from the first city in raw order to 'city', forwards and backwards
+	def _prefix( self, city ):
+		s = self._seg[city]
+		r = self._rank[s]
+		if self._rev[s]:
+			last = self._last[s]
+			return self._aheadAt[r] + self._bwd[last] - self._bwd[city], self._backAt[r] + self._fwd[last] - self._fwd[city]
+		first = self._first[s]
+		return self._aheadAt[r] + self._fwd[city] - self._fwd[first], self._backAt[r] + self._bwd[city] - self._bwd[first]
+
+	# Redoes the costs up to the start of each segment and of the whole tour, both ways in raw order
+	# TIME: number of segments
+	def _sumSegments( self ):
+		segments = np.array( self._order, dtype=np.intp )
+		rev = np.array( self._rev )[segments]
+		first = np.array( self._first, dtype=np.intp )[segments]
+		last = np.array( self._last, dtype=np.intp )[segments]
+		inner_fwd = np.array( self._innerFwd, dtype=np.int64 )[segments]
+		inner_bwd = np.array( self._innerBwd, dtype=np.int64 )[segments]
+
+		# Each segment's own edges in raw order, then the edge on to the next segment
+		heads = np.where( rev, last, first )
+		tails = np.where( rev, first, last )
+		joins = np.concatenate( (heads[1:], heads[:1]) )
+		ahead = np.cumsum( np.where(rev, inner_bwd, inner_fwd) + self._costs[tails, joins] ).tolist()
+		back = np.cumsum( np.where(rev, inner_fwd, inner_bwd) + self._costs[joins, tails] ).tolist()
+
+		self._rawAhead, self._rawBack = ahead[-1], back[-1]
+		self._aheadAt, self._backAt = [0] + ahead[:-1], [0] + back[:-1]
+		self._stale = False
+
+	# Costs of the raw path x -> ... -> y inside segment s
+	def _inside( self, s, x, y ):
+		if self._rev[s]:
+			return self._bwd[x] - self._bwd[y], self._fwd[x] - self._fwd[y]
+		return self._fwd[y] - self._fwd[x], self._bwd[y] - self._bwd[x]